@@ -98,6 +98,18 @@ function startGame(name) {
     socket.on('state', (state) => {
       updateGame(state);
     });
+
+    // After the full state on join, the server only sends what changed
+    socket.on('delta', (delta) => {
+      applyDelta(delta);
+    });
+
+    // The server groups several events for this client into one packet
+    socket.on('batch', (events) => {
+      events.forEach(([event, data]) => {
+        socket.listeners(event).forEach((listener) => listener(data));
+      });
+    });
     
     socket.emit('join', { username });
     initScene();
@@ -408,6 +420,22 @@ function handleKey(e) {
   plane.position.set(planePos.x, planePos.y, 0);
 }
 
+/**
+ * Apply a state delta (added and removed stars) to the current stars
+ * @param {Object} delta - Score, players and star changes since the last broadcast
+ */
+function applyDelta(delta) {
+  const removed = new Set(delta.stars_rm);
+  const current = stars.filter((star) => !removed.has(star.id));
+  const known = new Set(current.map((star) => star.id));
+  delta.stars_add.forEach((star) => {
+    if (!known.has(star.id)) {
+      current.push(star);
+    }
+  });
+  updateGame({ score: delta.score, players: delta.players, stars: current });
+}
+
 function updateGame(state) {
   document.getElementById('score').textContent = `Score: ${state.score}`;
   stars = state.stars;
@@ -3,28 +3,33 @@
 SQLite Database Backup Script
 Creates timestamped backups of the Sky Squad Flight Simulator database
 """
+import errno
 import os
 import shutil
 import logging
-import json
+import sqlite3
 import sys
 from datetime import datetime
 from typing import Optional, Dict, Any
 
 
+try:
+    from server.log_format import JsonFormatter as _BaseJsonFormatter
+except ImportError:  # run as a script from inside server/
+    from log_format import JsonFormatter as _BaseJsonFormatter
+
+
+class JsonFormatter(_BaseJsonFormatter):
+    """JSON log lines tagged with this script's component"""
+    component = "DBBackup"
+
+
 # Configure JSON logging
-logging.basicConfig(
-    level=logging.INFO,
-    format=json.dumps({
-        "timestamp": "%(asctime)s",
-        "level": "%(levelname)s",
-        "message": "%(message)s",
-        "component": "DBBackup",
-        "function": "%(funcName)s"
-    }),
-    datefmt="%Y-%m-%dT%H:%M:%SZ"
-)
 logger = logging.getLogger("db_backup")
+logger.setLevel(logging.INFO)
+_handler = logging.StreamHandler()
+_handler.setFormatter(JsonFormatter())
+logger.addHandler(_handler)
 
 
 def get_db_paths() -> Dict[str, str]:
@@ -63,18 +68,54 @@ def ensure_backup_directory(backup_dir: str) -> None:
         sys.exit(1)
 
 
-def backup_database() -> Optional[str]:
+def _fast_copy(src: str, dst: str) -> None:
+    """
+    Copy a file in the kernel with copy_file_range, falling back to shutil
+    
+    Args:
+        src: Source file path
+        dst: Destination file path
+    """
+    if hasattr(os, "copy_file_range"):
+        src_fd = os.open(src, os.O_RDONLY)
+        try:
+            dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                while os.copy_file_range(src_fd, dst_fd, 2 ** 30) > 0:
+                    pass
+                shutil.copystat(src, dst)
+                return
+            except OSError as e:
+                if e.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL):
+                    raise
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+    
+    shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
+
+
+def backup_database(paths: Optional[Dict[str, str]] = None) -> Optional[str]:
     """
     Create a timestamped backup of the SQLite database
     
+    Args:
+        paths: Result of get_db_paths(), resolved from the environment if omitted
+    
     Returns:
         Optional[str]: Path to the backup file if successful, None otherwise
     """
-    paths = get_db_paths()
+    if paths is None:
+        paths = get_db_paths()
     db_path = paths["db_path"]
     backup_dir = paths["backup_dir"]
     
-    if not os.path.exists(db_path):
+    # One stat both checks existence and gives the size used below
+    try:
+        src_size = os.stat(db_path).st_size
+    except FileNotFoundError:
         logger.error(
             "Database file not found",
             extra={"db_path": db_path}
@@ -90,41 +131,52 @@ def backup_database() -> Optional[str]:
     
     # Copy database file
     try:
-        # SQLite recommended way: Create a database connection and use backup API
-        if os.path.getsize(db_path) > 0:  # Check if source file is not empty
-            import sqlite3
-            
+        # Hot backup: VACUUM INTO writes a compacted copy from inside SQLite
+        if src_size > 0:  # Check if source file is not empty
             # Connect to source database
             source_conn = sqlite3.connect(db_path)
             
-            # Connect to destination database (will create if doesn't exist)
-            backup_conn = sqlite3.connect(backup_path)
-            
-            # Use SQLite's backup API for safe copying of hot database
-            source_conn.backup(backup_conn)
-            
-            # Close connections
-            backup_conn.close()
-            source_conn.close()
+            try:
+                if sqlite3.sqlite_version_info >= (3, 27, 0):
+                    # VACUUM INTO refuses an existing file; a rerun within the
+                    # same second replaces it, as the backup API would
+                    try:
+                        os.remove(backup_path)
+                    except FileNotFoundError:
+                        pass
+                    source_conn.execute("VACUUM INTO ?", (backup_path,))
+                    method = "vacuum_into"
+                else:
+                    # VACUUM INTO needs SQLite 3.27+, use the backup API
+                    backup_conn = sqlite3.connect(backup_path)
+                    try:
+                        source_conn.backup(backup_conn)
+                    finally:
+                        backup_conn.close()
+                    method = "backup_api"
+            finally:
+                source_conn.close()
             
             logger.info(
-                "Database backed up successfully using SQLite backup API",
+                "Database backed up successfully",
                 extra={
                     "source": db_path,
                     "destination": backup_path,
-                    "timestamp": timestamp,
-                    "size_bytes": os.path.getsize(backup_path)
+                    "backup_stamp": timestamp,
+                    "method": method,
+                    "source_size_bytes": src_size,
+                    "size_bytes": os.stat(backup_path).st_size
                 }
             )
         else:
             # Fallback to file copy for empty databases
-            shutil.copy2(db_path, backup_path)
+            _fast_copy(db_path, backup_path)
             logger.info(
                 "Empty database backed up using file copy",
                 extra={
                     "source": db_path,
                     "destination": backup_path,
-                    "timestamp": timestamp
+                    "backup_stamp": timestamp
                 }
             )
         
@@ -155,20 +207,21 @@ def cleanup_old_backups(backup_dir: str, keep: int = 5) -> None:
         keep: Number of recent backups to preserve
     """
     try:
-        # Get all backup files
-        backup_files = [
-            f
-            for f in os.listdir(backup_dir)
-            if f.startswith("game_") and f.endswith(".db")
-        ]
+        # Get all backup files as (name, path) pairs in a single pass
+        with os.scandir(backup_dir) as it:
+            backup_files = [
+                (entry.name, entry.path)
+                for entry in it
+                if entry.name.startswith("game_") and entry.name.endswith(".db")
+            ]
         
-        # Sort by timestamp (newest first)
-        backup_files.sort(reverse=True)
+        # Sort by timestamp (newest first); YYYYMMDD_HHMMSS names sort
+        # chronologically as plain strings
+        backup_files.sort(key=lambda item: item[0], reverse=True)
         
         # Remove old backups
-        for old_backup in backup_files[keep:]:
-            old_backup_path = os.path.join(backup_dir, old_backup)
-            os.remove(old_backup_path)
+        for old_backup, old_backup_path in backup_files[keep:]:
+            os.unlink(old_backup_path)
             logger.info(
                 "Removed old backup",
                 extra={"file": old_backup}
@@ -185,13 +238,40 @@ def cleanup_old_backups(backup_dir: str, keep: int = 5) -> None:
         )
 
 
+def stream_backup(dst_fd: int, path: str) -> int:
+    """
+    Send a backup file to an open descriptor with os.sendfile
+    
+    The kernel copies page-cache pages straight to the destination, so
+    shipping a backup to a socket or another file never passes the data
+    through Python buffers.
+    
+    Args:
+        dst_fd: Destination file descriptor (socket or regular file)
+        path: Path of the backup file to send
+    
+    Returns:
+        int: Number of bytes sent
+    """
+    with open(path, "rb") as f:
+        src_fd = f.fileno()
+        size = os.fstat(src_fd).st_size
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    return offset
+
+
 def main() -> int:
     """Main function to backup the database"""
-    backup_path = backup_database()
+    paths = get_db_paths()
+    backup_path = backup_database(paths)
     
     if backup_path:
         # Cleanup old backups
-        paths = get_db_paths()
         cleanup_old_backups(paths["backup_dir"])
         return 0
     else:
@@ -6,23 +6,83 @@ Creates all necessary tables for the Sky Squad Flight Simulator
 import os
 import sqlite3
 import logging
-import json
 import sys
 from datetime import datetime
 
+try:
+    from server.log_format import JsonFormatter as _BaseJsonFormatter
+except ImportError:  # run as a script from inside server/
+    from log_format import JsonFormatter as _BaseJsonFormatter
+
+
+class JsonFormatter(_BaseJsonFormatter):
+    """JSON log lines tagged with this script's component"""
+    component = "DBInit"
+
+
 # Configure JSON logging
-logging.basicConfig(
-    level=logging.INFO,
-    format=json.dumps({
-        "timestamp": "%(asctime)s",
-        "level": "%(levelname)s",
-        "message": "%(message)s",
-        "component": "DBInit",
-        "function": "%(funcName)s"
-    }),
-    datefmt="%Y-%m-%dT%H:%M:%SZ"
-)
 logger = logging.getLogger("db_init")
+logger.setLevel(logging.INFO)
+_handler = logging.StreamHandler()
+_handler.setFormatter(JsonFormatter())
+logger.addHandler(_handler)
+
+# WAL must be enabled outside a transaction; the trailing BEGIN is left
+# open so the settings inserts share the same commit
+SCHEMA_SQL = '''
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT UNIQUE NOT NULL,
+    experience INTEGER DEFAULT 0,
+    level INTEGER DEFAULT 0,
+    total_stars INTEGER DEFAULT 0,
+    special_stars INTEGER DEFAULT 0,
+    login_streak INTEGER DEFAULT 0,
+    last_login TEXT,
+    created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS achievements (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    achievement_id TEXT,
+    unlocked_at TEXT,
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    UNIQUE(user_id, achievement_id)
+);
+
+CREATE TABLE IF NOT EXISTS challenges (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    challenge_id TEXT,
+    progress INTEGER DEFAULT 0,
+    goal INTEGER,
+    completed BOOLEAN DEFAULT 0,
+    expires_at TEXT,
+    created_at TEXT,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+CREATE TABLE IF NOT EXISTS game_settings (
+    key TEXT PRIMARY KEY,
+    value TEXT,
+    description TEXT,
+    updated_at TEXT
+);
+'''
+
+DEFAULT_SETTINGS = [
+    ('star_base_value', '1', 'Base value for regular stars'),
+    ('star_special_value', '5', 'Value for special stars'),
+    ('xp_per_star', '10', 'XP awarded per star'),
+    ('max_player_level', '30', 'Maximum player level'),
+    ('challenge_duration_hours', '24', 'Duration of daily challenges in hours'),
+    ('daily_challenges_count', '3', 'Number of daily challenges to generate')
+]
 
 def get_db_path():
     """Get the database path from environment or use default"""
@@ -64,81 +124,24 @@ def init_database():
         extra={"db_path": db_path}
     )
     
+    conn = None
     try:
         conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
         
-        # Create users table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id TEXT PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            experience INTEGER DEFAULT 0,
-            level INTEGER DEFAULT 0,
-            total_stars INTEGER DEFAULT 0,
-            special_stars INTEGER DEFAULT 0,
-            login_streak INTEGER DEFAULT 0,
-            last_login TEXT,
-            created_at TEXT
-        )
-        ''')
-        
-        # Create achievements table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS achievements (
-            id TEXT PRIMARY KEY,
-            user_id TEXT,
-            achievement_id TEXT,
-            unlocked_at TEXT,
-            FOREIGN KEY (user_id) REFERENCES users(id),
-            UNIQUE(user_id, achievement_id)
-        )
-        ''')
-        
-        # Create challenges table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS challenges (
-            id TEXT PRIMARY KEY,
-            user_id TEXT,
-            challenge_id TEXT,
-            progress INTEGER DEFAULT 0,
-            goal INTEGER,
-            completed BOOLEAN DEFAULT 0,
-            expires_at TEXT,
-            created_at TEXT,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-        ''')
-        
-        # Create game_settings table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS game_settings (
-            key TEXT PRIMARY KEY,
-            value TEXT,
-            description TEXT,
-            updated_at TEXT
-        )
-        ''')
+        # Create all tables in one parse and one transaction
+        conn.executescript(SCHEMA_SQL)
         
         # Create initial settings if they don't exist
-        settings = [
-            ('star_base_value', '1', 'Base value for regular stars'),
-            ('star_special_value', '5', 'Value for special stars'),
-            ('xp_per_star', '10', 'XP awarded per star'),
-            ('max_player_level', '30', 'Maximum player level'),
-            ('challenge_duration_hours', '24', 'Duration of daily challenges in hours'),
-            ('daily_challenges_count', '3', 'Number of daily challenges to generate')
-        ]
-        
-        cursor.executemany('''
+        now = datetime.utcnow().isoformat() + "Z"
+        conn.executemany('''
         INSERT OR IGNORE INTO game_settings (key, value, description, updated_at)
         VALUES (?, ?, ?, ?)
-        ''', [(k, v, d, datetime.utcnow().isoformat() + "Z") for k, v, d in settings])
+        ''', [(k, v, d, now) for k, v, d in DEFAULT_SETTINGS])
         
         conn.commit()
         logger.info(
             "Database successfully initialized",
-            extra={"tables_created": 4, "initial_settings": len(settings)}
+            extra={"tables_created": 4, "initial_settings": len(DEFAULT_SETTINGS)}
         )
     except sqlite3.Error as e:
         logger.error(
@@ -0,0 +1,46 @@
+"""
+Shared JSON log formatting for the Sky Squad server and DB scripts
+"""
+import json
+import logging
+
+# Optional C-accelerated JSON encoder, stdlib json is used when missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Attributes present on every LogRecord; anything else came from extra=
+RESERVED_ATTRS = frozenset(
+    vars(logging.LogRecord("", 0, "", 0, "", (), None))
+) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format each record as a single JSON object, including extra fields"""
+    # Set by subclasses to tag every line with the emitting component
+    component = None
+
+    def format(self, record):
+        log_record = {
+            # Epoch seconds straight from the record, no strftime per line
+            "timestamp": record.created,
+            "level": record.levelname,
+            "name": record.name,
+            "message": record.getMessage(),
+            "function": record.funcName
+        }
+        if self.component:
+            log_record["component"] = self.component
+
+        # Extra fields never replace the base keys above
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS and key not in log_record:
+                log_record[key] = value
+
+        if record.exc_info:
+            log_record["exception"] = self.formatException(record.exc_info)
+
+        if orjson is not None:
+            return orjson.dumps(log_record, default=str).decode()
+        return json.dumps(log_record, default=str)
@@ -1,35 +1,31 @@
 # Standard library imports
+import atexit
+import hashlib
+import hmac
+import itertools
+import logging.handlers
 import os
+import queue
 import random
+import secrets
 import json
 import logging
 import time
-import traceback
-from uuid import uuid4
+from collections import Counter, OrderedDict
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 
-# Configure logging
-import json
+# Optional C-accelerated JSON encoder, stdlib json is used when missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-class JsonFormatter(logging.Formatter):
-    def format(self, record):
-        log_record = {
-            'timestamp': self.formatTime(record),
-            'level': record.levelname,
-            'name': record.name,
-            'message': record.getMessage()
-        }
-        
-        # Add extra fields if available
-        if hasattr(record, 'extra') and record.extra:
-            log_record.update(record.extra)
-            
-        # Add exception info if available
-        if record.exc_info:
-            log_record['exception'] = self.formatException(record.exc_info)
-            
-        return json.dumps(log_record)
+# Configure logging
+try:
+    from server.log_format import JsonFormatter
+except ImportError:  # run from inside server/
+    from log_format import JsonFormatter
 
 # Set up logger with appropriate format based on environment setting
 logger = logging.getLogger(__name__)
@@ -49,7 +45,21 @@ else:
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     
 ch.setFormatter(formatter)
-logger.addHandler(ch)
+
+class RawQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records as-is for an in-process QueueListener"""
+    def prepare(self, record):
+        # The stock prepare() formats the message and traceback on the
+        # caller's thread; the listener shares this process, so skip it
+        return record
+
+# Log calls only enqueue the record; formatting and the stream write happen
+# on the listener's thread, off the event loop
+log_queue = queue.SimpleQueue()
+logger.addHandler(RawQueueHandler(log_queue))
+log_listener = logging.handlers.QueueListener(log_queue, ch)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 # Track if we're using real FastAPI or dummy implementation
 USING_REAL_FASTAPI = True
@@ -58,6 +68,7 @@ try:
     # FastAPI and related imports
     from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException
     from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import JSONResponse, ORJSONResponse
     from fastapi_socketio import SocketManager
     from pydantic import BaseModel
     
@@ -66,9 +77,10 @@ try:
     from authlib.integrations.requests_client import OAuth2Session
     
     # Database libraries
-    from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Boolean
+    from sqlalchemy import bindparam, event, insert, select, update, create_engine, Column, Integer, String, DateTime, ForeignKey, Boolean
     from sqlalchemy.ext.declarative import declarative_base
     from sqlalchemy.orm import sessionmaker, Session, relationship
+    from sqlalchemy.pool import QueuePool
     from passlib.hash import bcrypt
     
     # Import progression system
@@ -205,6 +217,7 @@ except Exception as e:  # fallback for tests
         def __init__(self, *args, **kwargs):
             pass
     Integer = String = DateTime = Boolean = object
+    QueuePool = None
     def ForeignKey(col_name):
         return None
     class Session:
@@ -220,6 +233,9 @@ except Exception as e:  # fallback for tests
         @staticmethod
         def verify(p, h):
             return p == h
+        @classmethod
+        def using(cls, **settings):
+            return cls
     bcrypt = DummyBcrypt
     jwt = None
     JWTError = Exception
@@ -228,6 +244,11 @@ except Exception as e:  # fallback for tests
 SECRET_KEY = os.getenv('SECRET_KEY', 'secret')
 ALGORITHM = os.getenv('ALGORITHM', 'HS256')
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', 30))
+# Cost for new password hashes; passlib's default of 12 takes ~4x as long.
+# Existing hashes keep verifying at whatever cost they were made with.
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 10))
+# Built once; passlib's using() creates a new handler class per call
+_password_hasher = bcrypt.using(rounds=BCRYPT_ROUNDS)
 
 import uvicorn
 import asyncio
@@ -237,7 +258,8 @@ if USING_REAL_FASTAPI:
     # Real FastAPI with all features
     app = FastAPI(title="Sky Squad Game Server", 
            description="Backend server for Sky Squad kids flight simulator",
-           version="1.0.0")
+           version="1.0.0",
+           default_response_class=ORJSONResponse if orjson is not None else JSONResponse)
     # Enable CORS
     app.add_middleware(
         CORSMiddleware,
@@ -252,22 +274,88 @@ else:
     app = FastAPI()
     logger.warning("Using dummy FastAPI implementation")
     
+class OrjsonCodec:
+    """json-module shim so socket.io encodes and decodes packets with orjson"""
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs) -> str:
+        return orjson.dumps(obj).decode()
+
+    @staticmethod
+    def loads(data, *args, **kwargs):
+        return orjson.loads(data)
+
+
 # Initialize SocketManager for real-time communication
-sm = SocketManager(app=app)
+if orjson is not None:
+    sm = SocketManager(app=app, json=OrjsonCodec)
+else:
+    sm = SocketManager(app=app)
 
 # Initialize progression system
 player_progression = None
 
+def get_progression() -> 'PlayerProgression':
+    """Return the process-wide progression tracker, creating it on first use"""
+    global player_progression
+    if player_progression is None:
+        player_progression = PlayerProgression(SessionLocal())
+    return player_progression
+
+def get_challenges_payload() -> List[dict]:
+    """Return the challenges payload, shared by every client"""
+    # The progression tracker caches the serialized list and rebuilds it as
+    # soon as the challenge set rolls over
+    return get_progression().get_challenges()
+
 @app.on_event("startup")
 async def initialize_progression():
-    global player_progression
-    player_progression = PlayerProgression(SessionLocal())
+    get_progression()
 
 @app.on_event('startup')
 async def startup_event():
     asyncio.create_task(spawn_stars())
+    asyncio.create_task(broadcast_loop())
+    asyncio.create_task(star_credit_loop())
+
+@app.on_event('shutdown')
+async def shutdown_event():
+    await flush_star_credits()
+
+# A fixed pool of reusable connections; with WAL (see SQLITE_PRAGMAS) the
+# worker threads' readers don't block on the star-credit writer
+engine = create_engine(
+    'sqlite:///app.db',
+    connect_args={'check_same_thread': False},
+    poolclass=QueuePool,
+    pool_size=10,
+    max_overflow=10,
+)
+
+# Per-connection SQLite tuning: serve reads from a memory map and a large
+# page cache, and let readers run alongside the writer
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA temp_store=MEMORY',
+)
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Run SQLITE_PRAGMAS once on each new DBAPI connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+if USING_REAL_FASTAPI:
+    event.listen(engine, 'connect', _apply_sqlite_pragmas)
 
-engine = create_engine('sqlite:///app.db', connect_args={'check_same_thread': False})
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
@@ -333,6 +421,17 @@ class ChallengeProgress(Base):
 
 Base.metadata.create_all(bind=engine)
 
+# Username lookups are built once so SQLAlchemy reuses their compiled SQL
+if USING_REAL_FASTAPI:
+    _user_by_name = select(User).where(User.username == bindparam('username'))
+    _user_id_by_name = select(User.id).where(User.username == bindparam('username'))
+    # Core rather than ORM update, so a list of parameters runs as one executemany
+    _credit_stars = (
+        update(User.__table__)
+        .where(User.__table__.c.id == bindparam('user_id'))
+        .values(stars=User.__table__.c.stars + bindparam('delta'))
+    )
+
 class RegisterRequest(BaseModel):
     username: str
     email: str
@@ -343,27 +442,53 @@ class LoginRequest(BaseModel):
     username: str
     password: str
 
-def get_db():
+# An async generator runs on the event loop; FastAPI would enter and exit a
+# plain generator dependency through its threadpool on every request
+async def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
-def create_token(username: str) -> str:
+def create_token(username: str, user_id: int | None = None) -> str:
     """Return a JWT for the given username with a 1 hour expiry."""
     if jwt is None:
         return username
     exp = int(time.time()) + 3600
     payload = {'sub': username, 'exp': exp}
+    if user_id is not None:
+        # Lets the websocket join skip the username lookup
+        payload['uid'] = user_id
     return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
 
 
+# Verified JWT payloads keyed by a SHA-256 digest of the token (raw tokens
+# are never held), least recently used first. Entries live for a few
+# seconds at most and never past the token's own expiry; failures are not
+# cached.
+TOKEN_CACHE_SIZE = 4096
+TOKEN_CACHE_TTL = 10
+_token_cache = OrderedDict()
+
+
 def verify_token(token: str) -> dict | None:
     """Validate a JWT and return the payload if valid."""
     if jwt is None:
         return token
+    key = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+    cached = _token_cache.get(key)
+    if cached is not None:
+        if cached[0] > now:
+            _token_cache.move_to_end(key)
+            return cached[1]
+        del _token_cache[key]
     try:
+        # Reject expired tokens before paying for the signature check
+        exp = jwt.get_unverified_claims(token).get('exp')
+        if exp is not None and exp < int(now):
+            return None
         payload = jwt.decode(
             token,
             SECRET_KEY,
@@ -372,25 +497,29 @@ def verify_token(token: str) -> dict | None:
         )
     except Exception:
         return None
-    exp = payload.get('exp')
-    if exp is not None and exp < int(time.time()):
-        return None
+    valid_until = now + TOKEN_CACHE_TTL
+    if exp is not None:
+        valid_until = min(valid_until, exp)
+    _token_cache[key] = (valid_until, payload)
+    if len(_token_cache) > TOKEN_CACHE_SIZE:
+        _token_cache.popitem(last=False)
     return payload
 
 @app.post('/register')
 async def register(req: RegisterRequest, db: Session = Depends(get_db)):
     try:
         # Log detailed registration information
-        logger.info("Registration attempt", extra={
-            "username": req.username,
-            "email": req.email,
-            "has_password": bool(req.password),
-            "request_info": {
-                "endpoint": "/register",
-                "method": "POST",
-                "timestamp": datetime.now().isoformat()
-            }
-        })
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Registration attempt", extra={
+                "username": req.username,
+                "email": req.email,
+                "has_password": bool(req.password),
+                "request_info": {
+                    "endpoint": "/register",
+                    "method": "POST",
+                    "ts_ns": time.time_ns()
+                }
+            })
         
         # Validate required fields
         if not req.username or not req.email or not req.password:
@@ -410,7 +539,8 @@ async def register(req: RegisterRequest, db: Session = Depends(get_db)):
         # Process registration
         try:
             data = req.dict()
-            register_user(data, db)
+            # bcrypt is deliberately slow; keep it off the event loop
+            await asyncio.to_thread(register_user, data, db)
             logger.info("Registration successful", extra={"username": req.username})
             return {'status': 'ok', 'username': req.username}
         except Exception as e:
@@ -435,104 +565,324 @@ async def register(req: RegisterRequest, db: Session = Depends(get_db)):
         logger.error("Registration unexpected error", extra={
             "username": req.username if hasattr(req, 'username') else "unknown",
             "error": str(e),
-            "error_type": type(e).__name__,
-            "traceback": traceback.format_exc()
-        })
+            "error_type": type(e).__name__
+        }, exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error during registration")
 
 
+# Recent successful bcrypt checks, keyed by the stored hash and a keyed
+# digest of the attempt so a password change misses the cache; kept briefly
+# so repeat logins skip the KDF. Only successes are cached, so every wrong
+# guess still pays for bcrypt.
+LOGIN_CACHE_SIZE = 10_000
+LOGIN_CACHE_TTL = 30.0
+_login_cache = OrderedDict()
+# Per-process HMAC key, so cached digests can't be brute-forced offline
+_login_cache_secret = secrets.token_bytes(32)
+
+
+async def check_password(password: str, hashed: str) -> bool:
+    """Verify a password against its bcrypt hash, reusing recent successes."""
+    key = (hashed, hmac.new(_login_cache_secret, password.encode(), hashlib.sha256).digest())
+    now = time.monotonic()
+    expires = _login_cache.get(key)
+    if expires is not None and expires > now:
+        _login_cache.move_to_end(key)
+        return True
+    # bcrypt is deliberately slow; keep it off the event loop
+    ok = await asyncio.to_thread(bcrypt.verify, password, hashed)
+    if ok:
+        _login_cache[key] = now + LOGIN_CACHE_TTL
+        _login_cache.move_to_end(key)
+        if len(_login_cache) > LOGIN_CACHE_SIZE:
+            _login_cache.popitem(last=False)
+    return ok
+
+
 @app.post('/login')
 async def login(req: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter_by(username=req.username).first()
-    if not user or not bcrypt.verify(req.password, user.password):
+    user = db.execute(_user_by_name, {'username': req.username}).scalar_one_or_none()
+    if not user or not await check_password(req.password, user.password):
         raise HTTPException(status_code=401, detail='Invalid credentials')
-    token = create_token(user.username)
+    token = create_token(user.username, user.id)
     return {'token': token}
 
+# /stats star counts by username, served for a few seconds and dropped as
+# soon as the user's next star credit is written
+STATS_CACHE_SIZE = 10_000
+STATS_CACHE_TTL = 10.0
+_stats_cache = OrderedDict()  # username -> (expires_at, user_id, stars)
+_stats_cache_names = {}  # user_id -> username
+
+
+def cache_user_stats(username: str, user_id: int, stars: int) -> None:
+    """Remember a user's star count for STATS_CACHE_TTL seconds."""
+    _stats_cache[username] = (time.monotonic() + STATS_CACHE_TTL, user_id, stars)
+    _stats_cache.move_to_end(username)
+    _stats_cache_names[user_id] = username
+    if len(_stats_cache) > STATS_CACHE_SIZE:
+        _, (_, old_id, _) = _stats_cache.popitem(last=False)
+        _stats_cache_names.pop(old_id, None)
+
+
+def invalidate_user_stats(user_ids) -> None:
+    """Forget cached star counts for users whose totals just changed."""
+    for user_id in user_ids:
+        username = _stats_cache_names.pop(user_id, None)
+        if username is not None:
+            _stats_cache.pop(username, None)
+
+
 @app.get('/stats')
 async def get_stats(authorization: str = '', db: Session = Depends(get_db)):
-    token = authorization.replace('Bearer ', '') if authorization else ''
+    # The scheme name is case-insensitive (RFC 7235)
+    token = authorization[7:] if authorization[:7].lower() == 'bearer ' else authorization
     payload = verify_token(token)
     username = payload.get('sub') if payload else None
-    user = db.query(User).filter_by(username=username).first() if username else None
+    if not username:
+        raise HTTPException(status_code=404, detail='User not found')
+    cached = _stats_cache.get(username)
+    if cached is not None and cached[0] > time.monotonic():
+        return {'username': username, 'stars': cached[2]}
+    user = db.execute(_user_by_name, {'username': username}).scalar_one_or_none()
     if not user:
         raise HTTPException(status_code=404, detail='User not found')
+    cache_user_stats(username, user.id, user.stars)
     return {'username': username, 'stars': user.stars}
 
 # Game state variables
 players = {}
 score = 0
-stars = []
-star_id_counter = 0
-
-# Configure logger
-logger = logging.getLogger("sky_squad")
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler()
-handler.setFormatter(logging.Formatter(json.dumps({
-    "timestamp": "%(asctime)s",
-    "level": "%(levelname)s",
-    "message": "%(message)s",
-    "module": "%(module)s",
-    "function": "%(funcName)s"
-})))
-logger.addHandler(handler)
+# Live stars keyed by id for O(1) collect
+stars = {}
+# Star ids are client-visible strings built from a process-local counter
+_next_star_number = itertools.count(1).__next__
+
+# Bumped on every game-state mutation; the full snapshot and the broadcast
+# delta are each rebuilt only when it changes
+_state_version = 0
+_state_snapshot = None
+_state_snapshot_version = -1
+_state_delta = None
+_state_delta_version = -1
+
+# Star changes since the last broadcast delta
+_stars_added = {}
+_stars_removed = []
+
+# Game state is pushed to all clients at most this often (30 Hz), and at
+# least once per heartbeat while nothing changes
+STATE_BROADCAST_INTERVAL = 1 / 30
+STATE_HEARTBEAT_INTERVAL = 1.0
+# Wakes the broadcaster on a state change; created by broadcast_loop so it
+# belongs to the running event loop
+_state_changed = None
+
+# A new star appears this often, on a fixed schedule
+STAR_SPAWN_INTERVAL = 1.0
+# Unclaimed stars are capped; spawning past this evicts the oldest one
+MAX_STARS = 200
+
+# Star spawn positions and values are drawn in batches from a dedicated
+# generator; one star in ten is a special star worth 5
+STAR_POSITION_BATCH = 1024
+STAR_VALUES = (1, 5)
+STAR_VALUE_WEIGHTS = (9, 1)
+_star_rng = random.Random()
+_star_positions = []
+_star_values = []
+
+# Collected stars are credited to users in one batched UPDATE this often
+STAR_FLUSH_INTERVAL = 1.0
+# user_id -> stars collected since the last flush
+_pending_stars = Counter()
+
+# (dx, dy) applied to a player's position for each move command
+MOVE_DELTAS = {
+    'up': (0.0, 0.1),
+    'down': (0.0, -0.1),
+    'left': (-0.1, 0.0),
+    'right': (0.1, 0.0),
+}
+
+
+def mark_state_changed() -> None:
+    """Invalidate the cached state snapshot after a game-state mutation"""
+    global _state_version
+    _state_version += 1
+    if _state_changed is not None:
+        _state_changed.set()
+
+
+def _next_star_position() -> Tuple[float, float]:
+    """Pop a pre-drawn (x, y) spawn position, refilling the pool in bulk"""
+    if not _star_positions:
+        uniform = _star_rng.uniform
+        _star_positions.extend(
+            (uniform(-4.5, 4.5), uniform(-4.5, 4.5))
+            for _ in range(STAR_POSITION_BATCH)
+        )
+    return _star_positions.pop()
+
+
+def _next_star_value() -> int:
+    """Pop a pre-drawn star value, refilling the pool in bulk"""
+    if not _star_values:
+        _star_values.extend(_star_rng.choices(
+            STAR_VALUES, weights=STAR_VALUE_WEIGHTS, k=STAR_POSITION_BATCH))
+    return _star_values.pop()
+
+
+def _journal_star_removal(star_id: str) -> None:
+    """Record a removed star for the next broadcast delta"""
+    # Always send the removal: a client that joined since the last delta
+    # already has the star from its snapshot, even if it is not yet in a delta
+    _stars_added.pop(star_id, None)
+    _stars_removed.append(star_id)
 
 
 def generate_star():
     """Generate a new star with random position and value"""
-    global stars, star_id_counter
-    star_id_counter += 1
-    
-    # Randomly assign value - 10% chance of special star
-    value = 5 if random.random() < 0.1 else 1
+    if len(stars) >= MAX_STARS:
+        # Dicts keep insertion order, so the first key is the oldest star
+        oldest = next(iter(stars))
+        del stars[oldest]
+        _journal_star_removal(oldest)
+    value = _next_star_value()
+    x, y = _next_star_position()
     
     star = {
-        'id': f'star_{star_id_counter}',
-        'x': random.uniform(-4.5, 4.5),
-        'y': random.uniform(-4.5, 4.5),
+        'id': f'star_{_next_star_number()}',
+        'x': x,
+        'y': y,
         'value': value  # Add value property
     }
-    stars.append(star)
-    logger.info("Generated star", extra={
-        "star_id": star['id'],
-        "position": {"x": star['x'], "y": star['y']},
-        "value": star['value']
-    })
+    stars[star['id']] = star
+    _stars_added[star['id']] = star
+    mark_state_changed()
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Generated star", extra={
+            "star_id": star['id'],
+            "position": {"x": star['x'], "y": star['y']},
+            "value": star['value']
+        })
     return star
 
 async def spawn_stars():
     """Periodically spawn stars at random positions."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
     while True:
         generate_star()
-        await asyncio.sleep(1)
+        # Sleep to an absolute deadline so the spawn work doesn't stretch the
+        # period; after a stall the schedule restarts from now
+        deadline = max(deadline + STAR_SPAWN_INTERVAL, loop.time())
+        await asyncio.sleep(deadline - loop.time())
 
 
 def collect_star(star_id: str, socket: WebSocket | None = None) -> bool:
     """Remove a star and increase score if it exists."""
     global score
-    star = next((s for s in stars if s['id'] == star_id), None)
-    if not star:
+    star = stars.pop(star_id, None)
+    if star is None:
         return False
+    _journal_star_removal(star_id)
 
     star_value = star.get('value', 1)
-    stars.remove(star)
     score += star_value
+    mark_state_changed()
 
-    logger.info(
-        "Star collected",
-        extra={"star_id": star_id, "value": star_value, "new_score": score},
-    )
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "Star collected",
+            extra={"star_id": star_id, "value": star_value, "new_score": score},
+        )
 
     generate_star()
     return True
 
+def _player_columns() -> dict:
+    """Players as parallel columns rather than one dict each"""
+    roster = list(players.values())
+    return {
+        'names': [p['username'] for p in roster],
+        'xs': [p['x'] for p in roster],
+        'ys': [p['y'] for p in roster],
+    }
+
+def get_state_snapshot() -> dict:
+    """Return the full game state, rebuilt only after a mutation."""
+    global _state_snapshot, _state_snapshot_version
+    if _state_snapshot_version != _state_version:
+        _state_snapshot = {
+            'score': score,
+            'players': _player_columns(),
+            'stars': list(stars.values()),
+        }
+        _state_snapshot_version = _state_version
+    return _state_snapshot
+
+async def broadcast_state() -> None:
+    """Emit what changed since the last broadcast to every connected client.
+
+    Clients get the full state when they join; after that only star
+    additions and removals go out. Re-sending a delta is harmless, so
+    heartbeat ticks repeat the last one.
+    """
+    global _state_delta, _state_delta_version
+    if _state_delta_version != _state_version:
+        _state_delta = {
+            'score': score,
+            'players': _player_columns(),
+            'stars_add': list(_stars_added.values()),
+            'stars_rm': list(_stars_removed),
+        }
+        _stars_added.clear()
+        _stars_removed.clear()
+        _state_delta_version = _state_version
+    await sm.emit('delta', _state_delta)
+
+async def broadcast_loop():
+    """Broadcast the game state when it changes, capped at a fixed rate."""
+    global _state_changed
+    _state_changed = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await asyncio.wait_for(_state_changed.wait(),
+                                   timeout=STATE_HEARTBEAT_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _state_changed.clear()
+        tick_start = loop.time()
+        try:
+            await broadcast_state()
+        except Exception as e:
+            logger.error("State broadcast failed", extra={"error": str(e)})
+        # The rate cap counts from the start of the tick, not the end of the emit
+        await asyncio.sleep(max(0.0, tick_start + STATE_BROADCAST_INTERVAL - loop.time()))
+
+async def flush_outbound(outbound: list, room) -> None:
+    """Send queued (event, data) pairs to one client in a single packet."""
+    if not outbound:
+        return
+    if len(outbound) == 1:
+        event, data = outbound[0]
+        await sm.emit(event, data, room=room)
+    else:
+        await sm.emit('batch', list(outbound), room=room)
+    outbound.clear()
+
 @app.websocket('/ws')
 async def websocket_endpoint(socket: WebSocket):
     token = ''
     if hasattr(socket, 'query_params'):
         token = socket.query_params.get('token', '')
-    payload = verify_token(token)
+    # Turn away missing or malformed tokens without any signature work
+    if jwt is not None and (not token or token.count('.') != 2):
+        payload = None
+    else:
+        payload = verify_token(token)
     if payload is None:
         if hasattr(socket, 'close'):
             await socket.close(code=403)
@@ -540,102 +890,156 @@ async def websocket_endpoint(socket: WebSocket):
     if hasattr(socket, 'accept'):
         await socket.accept()
     await sm.connect(socket)
-    players[socket] = {'username': '', 'user_id': None, 'x': 0.0, 'y': 0.0}
+    # This connection's entry in players; it stays registered until the
+    # finally block below, so handlers use it directly
+    player = {'username': '', 'user_id': None, 'x': 0.0, 'y': 0.0}
+    players[socket] = player
+    mark_state_changed()
     
-    # Setup progression
-    progression = PlayerProgression(SessionLocal())
+    # Events for this client, sent together once each message is handled
+    outbound = []
     
     try:
+        # Shared progression tracker, one per process rather than per socket
+        progression = get_progression()
+        
         while True:
-            try:
-                data = await asyncio.wait_for(socket.receive_json(),
-                                             timeout=0.05)
-            except asyncio.TimeoutError:
-                data = None
+            # State goes out from broadcast_loop and star credits from
+            # star_credit_loop, so this loop only needs to wake for input
+            if orjson is not None:
+                data = orjson.loads(await socket.receive_text())
+            else:
+                data = await socket.receive_json()
                 
             if data:
-                if data.get('type') == 'join':
+                msg_type = data.get('type')
+                if msg_type == 'join':
                     username = data.get('username', '')
-                    players[socket]['username'] = username
+                    player['username'] = username
+                    mark_state_changed()
                     
                     # Get or create user
-                    db = SessionLocal()
                     try:
-                        user = db.query(User).filter(User.username == username).first()
-                        if not user:
-                            user = User(username=username, email=f"{username}@example.com", password="")
-                            db.add(user)
-                            db.commit()
-                            db.refresh(user)
+                        # Tokens from /login carry the user id for their own username
+                        user_id = None
+                        if isinstance(payload, dict) and payload.get('sub') == username:
+                            user_id = payload.get('uid')
+                        if user_id is None:
+                            user_id = await asyncio.to_thread(get_or_create_user_id, username)
                         
                         # Set user_id in player data
-                        players[socket]['user_id'] = user.id
+                        player['user_id'] = user_id
                         
                         # Update login streak
-                        streak, achievement = await progression.update_login_streak(user.id)
+                        streak, achievement = await progression.update_login_streak(user_id)
                         if achievement:
-                            await sm.emit('achievement', achievement, room=socket.client.sid)
+                            outbound.append(('achievement', achievement))
                             
                         # Send user progress data
-                        progress = await progression.get_user_progress(user.id)
-                        await sm.emit('progress', progress, room=socket.client.sid)
+                        progress = await progression.get_user_progress(user_id)
+                        outbound.append(('progress', progress))
                         
                         # Send challenges
-                        challenges = progression.get_challenges()
-                        await sm.emit('challenges', challenges, room=socket.client.sid)
+                        outbound.append(('challenges', get_challenges_payload()))
+
                     except Exception as e:
                         logger.error("Error processing join", extra={"error": str(e)})
-                    finally:
-                        db.close()
+                    
+                    # Full state once, built just before sending so later
+                    # broadcast deltas apply on top of it
+                    outbound.append(('state', get_state_snapshot()))
                         
-                elif data.get('type') == 'move' and socket in players:
-                    cmd = data.get('command')
-                    pos = players[socket]
-                    if cmd == 'up':
-                        pos['y'] += 0.1
-                    elif cmd == 'down':
-                        pos['y'] -= 0.1
-                    elif cmd == 'left':
-                        pos['x'] -= 0.1
-                    elif cmd == 'right':
-                        pos['x'] += 0.1
-                    players[socket] = pos
+                elif msg_type == 'move':
+                    delta = MOVE_DELTAS.get(data.get('command'))
+                    if delta:
+                        player['x'] += delta[0]
+                        player['y'] += delta[1]
+                        mark_state_changed()
                     
-                elif data.get('type') == 'collect_star':
+                elif msg_type == 'collect_star':
                     star_collected = collect_star(data.get('starId', ''), socket)
                     
-                    # Also update the user's star count in the database
-                    if star_collected:
-                        username = players[socket].get('username', '')
-                        if username:
-                            try:
-                                db = SessionLocal()
-                                user = db.query(User).filter_by(username=username).first()
-                                if user:
-                                    user.stars += 1
-                                    db.commit()
-                            finally:
-                                db.close()
+                    # The user's stored star count catches up on the next flush
+                    if star_collected and player['user_id']:
+                        _pending_stars[player['user_id']] += 1
                     
-                elif data.get('type') == 'get_progress' and socket in players and players[socket].get('user_id'):
-                    user_id = players[socket]['user_id']
-                    progress = await progression.get_user_progress(user_id)
-                    await sm.emit('progress', progress, room=socket.client.sid)
+                elif msg_type == 'get_progress' and player['user_id']:
+                    progress = await progression.get_user_progress(player['user_id'])
+                    outbound.append(('progress', progress))
                     
-                elif data.get('type') == 'get_challenges' and socket in players:
-                    challenges = progression.get_challenges()
-                    await sm.emit('challenges', challenges, room=socket.client.sid)
+                elif msg_type == 'get_challenges':
+                    outbound.append(('challenges', get_challenges_payload()))
+                
+                if outbound:
+                    await flush_outbound(outbound, socket.client.sid)
             
-            # Send game state update
-            state = {
-                'score': score,
-                'players': list(players.values()),
-                'stars': stars,
-            }
-            await sm.emit('state', state)
-            await asyncio.sleep(0.05)
     except WebSocketDisconnect:
-        players.pop(socket, None)
+        pass
+    finally:
+        if players.pop(socket, None) is not None:
+            mark_state_changed()
+
+
+# The blocking database helpers below run in worker threads via
+# asyncio.to_thread so the event loop keeps serving clients meanwhile
+
+def get_or_create_user_id(username: str) -> int:
+    """Return the id of the named user, creating a placeholder user if needed."""
+    # A short-lived session, so no pooled connection outlives the lookup
+    db = SessionLocal()
+    try:
+        user_id = db.execute(_user_id_by_name, {'username': username}).scalar()
+        if user_id is None:
+            user_id = db.execute(insert(User).values(
+                username=username,
+                email=f"{username}@example.com",
+                password="",
+                created_at=datetime.now(),
+            )).inserted_primary_key[0]
+            db.commit()
+        return user_id
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def write_star_credits(batch: Counter) -> bool:
+    """Apply a batch of star credits in a single transaction."""
+    db = SessionLocal()
+    try:
+        db.execute(_credit_stars, [
+            {'user_id': user_id, 'delta': delta}
+            for user_id, delta in batch.items()
+        ])
+        db.commit()
+        return True
+    except Exception as e:
+        db.rollback()
+        logger.error("Failed to save star counts", extra={"error": str(e)})
+        return False
+    finally:
+        db.close()
+
+
+async def flush_star_credits() -> None:
+    """Write every pending star credit, keeping them if the write fails."""
+    global _pending_stars
+    if not _pending_stars:
+        return
+    batch, _pending_stars = _pending_stars, Counter()
+    if await asyncio.to_thread(write_star_credits, batch):
+        invalidate_user_stats(batch)
+    else:
+        _pending_stars.update(batch)
+
+
+async def star_credit_loop():
+    """Flush pending star credits at a fixed interval."""
+    while True:
+        await asyncio.sleep(STAR_FLUSH_INTERVAL)
+        await flush_star_credits()
 
 
 def register_user(data: dict, db: Session = None) -> dict:
@@ -653,8 +1057,10 @@ def register_user(data: dict, db: Session = None) -> dict:
         close = True
 
     try:
-        if hasattr(db, 'query'):
-            existing = db.query(User).filter(User.username == data['username']).first()
+        if hasattr(db, 'execute'):
+            existing = db.execute(
+                _user_id_by_name, {'username': data['username']}
+            ).first()
             if existing:
                 return {'status': 'error', 'message': 'User already exists'}
         else:
@@ -662,19 +1068,19 @@ def register_user(data: dict, db: Session = None) -> dict:
                 if player.get('username') == data['username']:
                     return {'status': 'error', 'message': 'User already exists'}
 
-        hashed = bcrypt.hash(data['password'])
-        user = User(
-            username=data['username'],
-            email=data['email'],
-            password=hashed,
-        )
-        if hasattr(db, 'add'):
-            db.add(user)
+        hashed = _password_hasher.hash(data['password'])
+        if hasattr(db, 'execute'):
+            db.execute(insert(User).values(
+                username=data['username'],
+                email=data['email'],
+                password=hashed,
+                created_at=datetime.now(),
+            ))
             db.commit()
         else:
-            players[user.username] = {
-                'username': user.username,
-                'email': user.email,
+            players[data['username']] = {
+                'username': data['username'],
+                'email': data['email'],
                 'password': hashed,
             }
     finally:
@@ -684,4 +1090,9 @@ def register_user(data: dict, db: Session = None) -> dict:
     return {'status': 'ok'}
 
 if __name__ == '__main__':
-    uvicorn.run(app, host='0.0.0.0', port=8000)
+    # Game state lives in this process, so keep a single worker. Broadcasts
+    # are small and identical for every client, so skip per-socket deflate.
+    # 'auto' picks uvloop/httptools when installed (uvicorn[standard])
+    uvicorn.run(app, host='0.0.0.0', port=8000, loop='auto',
+                http='auto', ws='websockets', workers=1,
+                ws_per_message_deflate=False)
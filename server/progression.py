@@ -2,13 +2,33 @@
 Progression system for Sky Squad flight simulator
 Handles player experience, levels, achievements and challenges
 """
-import json
+import bisect
 import logging
 import random
 import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple, Union
 
+try:
+    from server.log_format import JsonFormatter as _BaseJsonFormatter
+except ImportError:  # imported from inside server/
+    from log_format import JsonFormatter as _BaseJsonFormatter
+
+
+class JsonFormatter(_BaseJsonFormatter):
+    """JSON log lines tagged with the progression component"""
+    component = "Progression"
+
+
+# Configure JSON logging once, however many PlayerProgression instances exist
+logger = logging.getLogger("progression")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(JsonFormatter())
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+
 class Achievement:
     """Achievement definition class"""
     def __init__(self, 
@@ -24,10 +44,8 @@ class Achievement:
         self.icon = icon
         self.points = points
         self.hidden = hidden
-    
-    def to_dict(self) -> dict:
-        """Convert achievement to dictionary for serialization"""
-        return {
+        # Achievements never change once defined, so serialize them once
+        self._dict = {
             "id": self.id,
             "title": self.title,
             "description": self.description,
@@ -35,6 +53,10 @@ class Achievement:
             "points": self.points,
             "hidden": self.hidden
         }
+    
+    def to_dict(self) -> dict:
+        """Convert achievement to dictionary for serialization (shared, do not mutate)"""
+        return self._dict
 
 
 class Challenge:
@@ -56,14 +78,10 @@ class Challenge:
         self.duration_hours = duration_hours
         self.start_time = datetime.now()
         self.end_time = self.start_time + timedelta(hours=duration_hours)
-    
-    def is_expired(self) -> bool:
-        """Check if challenge has expired"""
-        return datetime.now() > self.end_time
-    
-    def to_dict(self) -> dict:
-        """Convert challenge to dictionary for serialization"""
-        return {
+        # Expiry as an epoch float, so hot checks compare against time.time()
+        self._end_ts = self.end_time.timestamp()
+        # Everything except remaining_hours is fixed at creation
+        self._static_dict = {
             "id": self.id,
             "title": self.title,
             "description": self.description,
@@ -71,8 +89,18 @@ class Challenge:
             "reward": self.reward,
             "category": self.category,
             "start_time": self.start_time.isoformat(),
-            "end_time": self.end_time.isoformat(),
-            "remaining_hours": max(0, (self.end_time - datetime.now()).total_seconds() / 3600)
+            "end_time": self.end_time.isoformat()
+        }
+    
+    def is_expired(self, now: Optional[float] = None) -> bool:
+        """Check if challenge has expired (as of now, a time.time() value, if given)"""
+        return (now or time.time()) > self._end_ts
+    
+    def to_dict(self, now: Optional[float] = None) -> dict:
+        """Convert challenge to dictionary for serialization (as of now, a time.time() value, if given)"""
+        return {
+            **self._static_dict,
+            "remaining_hours": max(0.0, (self._end_ts - (now or time.time())) / 3600.0)
         }
 
 
@@ -82,6 +110,13 @@ class PlayerProgression:
     # Experience points required per level (exponential growth)
     LEVEL_THRESHOLDS = [0, 100, 250, 450, 700, 1000, 1000, 1750, 2200, 2700, 3250]
     
+    # Level for every XP value below the top threshold, so most lookups are one index
+    LEVEL_BY_XP = tuple(
+        level
+        for level, (start, end) in enumerate(zip(LEVEL_THRESHOLDS, LEVEL_THRESHOLDS[1:]))
+        for _ in range(start, end)
+    )
+    
     # Predefined achievements
     ACHIEVEMENTS = [
         Achievement("first_star", "First Star", "Collect your first star", "⭐", 5),
@@ -96,6 +131,22 @@ class PlayerProgression:
         Achievement("streak_7", "Dedicated Pilot", "Play 7 days in a row", "📆", 25),
     ]
     
+    # Achievements keyed by id for constant-time lookup
+    ACHIEVEMENTS_BY_ID = {a.id: a for a in ACHIEVEMENTS}
+    
+    # Bit assigned to each achievement in a user's achievement_mask
+    ACHIEVEMENT_BITS = {a.id: 1 << i for i, a in enumerate(ACHIEVEMENTS)}
+    
+    # Star-collection achievements as (achievement_id, counter, threshold)
+    STAR_ACHIEVEMENT_TIERS = (
+        ("first_star", "total_stars", 1),
+        ("collector_10", "total_stars", 10),
+        ("collector_50", "total_stars", 50),
+        ("collector_100", "total_stars", 100),
+        ("special_5", "special_stars", 5),
+        ("special_20", "special_stars", 20),
+    )
+    
     # Challenge templates
     CHALLENGE_TEMPLATES = [
         {"id": "collect_stars", "title": "Star Collector", "description": "Collect {goal} stars", 
@@ -108,28 +159,25 @@ class PlayerProgression:
          "goal_range": (50, 200), "reward_range": (30, 100), "category": "performance"},
     ]
     
+    # Longest a serialized challenge list is reused, so remaining_hours stays current
+    CHALLENGES_MAX_AGE_SECONDS = 60
+    
     def __init__(self, db_session):
         """Initialize progression system with database session"""
         self.db = db_session
-        self.logger = logging.getLogger("progression")
-        
-        # Setup JSON logging
-        for handler in self.logger.handlers:
-            self.logger.removeHandler(handler)
-        handler = logging.StreamHandler()
-        handler.setFormatter(logging.Formatter(json.dumps({
-            "timestamp": "%(asctime)s",
-            "level": "%(levelname)s",
-            "message": "%(message)s",
-            "module": "%(module)s",
-            "function": "%(funcName)s"
-        })))
-        self.logger.addHandler(handler)
-        self.logger.setLevel(logging.INFO)
+        self.logger = logger
         
         # Cache of player progression data
         self.players_cache = {}
         self.active_challenges = self._generate_daily_challenges()
+        
+        # Achievements are static, so their serialized list is built once
+        self._achievements_list = [a.to_dict() for a in self.ACHIEVEMENTS]
+        
+        # Serialized challenges, rebuilt when the challenge set is replaced
+        self._challenges_list = None
+        self._challenges_source = None
+        self._challenges_built_at = 0.0
     
     def _generate_daily_challenges(self, count: int = 3) -> List[Challenge]:
         """Generate a set of daily challenges"""
@@ -154,20 +202,29 @@ class PlayerProgression:
         self.logger.info("Generated daily challenges", extra={"count": len(challenges)})
         return challenges
     
-    def refresh_challenges(self):
+    def refresh_challenges(self, now: Optional[float] = None):
         """Refresh expired challenges"""
-        if not self.active_challenges or any(c.is_expired() for c in self.active_challenges):
+        now = now or time.time()
+        if not self.active_challenges or any(c.is_expired(now) for c in self.active_challenges):
             self.active_challenges = self._generate_daily_challenges()
             self.logger.info("Refreshed challenges", extra={"count": len(self.active_challenges)})
     
     def get_challenges(self) -> List[dict]:
         """Get current active challenges"""
-        self.refresh_challenges()
-        return [c.to_dict() for c in self.active_challenges]
+        now = time.time()
+        self.refresh_challenges(now)
+        built_at = time.monotonic()
+        if (self._challenges_source is self.active_challenges
+                and built_at - self._challenges_built_at < self.CHALLENGES_MAX_AGE_SECONDS):
+            return self._challenges_list
+        self._challenges_list = [c.to_dict(now) for c in self.active_challenges]
+        self._challenges_source = self.active_challenges
+        self._challenges_built_at = built_at
+        return self._challenges_list
     
     def get_achievements(self) -> List[dict]:
         """Get all available achievements"""
-        return [a.to_dict() for a in self.ACHIEVEMENTS]
+        return self._achievements_list
     
     async def add_experience(self, user_id: int, amount: int) -> Tuple[int, int, Optional[dict]]:
         """
@@ -206,9 +263,9 @@ class PlayerProgression:
                 
                 # Check for level achievements
                 if new_level >= 5:
-                    achievement = await self.unlock_achievement(user_id, "level_5")
+                    achievement = self._unlock_achievement_on(user, "level_5")
                 if new_level >= 10:
-                    achievement = await self.unlock_achievement(user_id, "level_10")
+                    achievement = self._unlock_achievement_on(user, "level_10")
             
             return new_xp, new_level, achievement
         
@@ -222,10 +279,10 @@ class PlayerProgression:
     
     def _calculate_level(self, xp: int) -> int:
         """Calculate level based on total XP"""
-        level = 0
-        while level < len(self.LEVEL_THRESHOLDS) - 1 and xp >= self.LEVEL_THRESHOLDS[level + 1]:
-            level += 1
-        return level
+        if 0 <= xp < len(self.LEVEL_BY_XP):
+            return self.LEVEL_BY_XP[xp]
+        # Thresholds are sorted, so the level is the last one whose threshold <= xp
+        return max(0, bisect.bisect_right(self.LEVEL_THRESHOLDS, xp) - 1)
     
     def get_next_level_xp(self, level: int) -> int:
         """Get XP required for next level"""
@@ -245,6 +302,7 @@ class PlayerProgression:
             "experience": 0,
             "level": 0,
             "achievements": [],
+            "achievement_mask": 0,
             "login_streak": 0,
             "last_login": datetime.now().isoformat()
         }
@@ -276,20 +334,39 @@ class PlayerProgression:
         """
         try:
             user = await self._get_user(user_id)
-            if not user:
-                return None
-            
-            # Check if already unlocked
-            if achievement_id in user.get("achievements", []):
-                return None
-            
+        except Exception as e:
+            self.logger.error("Error unlocking achievement", extra={
+                "user_id": user_id,
+                "achievement_id": achievement_id,
+                "error": str(e)
+            })
+            return None
+        if not user:
+            return None
+        return self._unlock_achievement_on(user, achievement_id)
+    
+    def _unlock_achievement_on(self, user: dict, achievement_id: str) -> Optional[dict]:
+        """
+        Unlock an achievement on an already fetched user record
+        
+        Returns:
+            Achievement data if newly unlocked, None otherwise
+        """
+        try:
             # Find achievement
-            achievement = next((a for a in self.ACHIEVEMENTS if a.id == achievement_id), None)
+            achievement = self.ACHIEVEMENTS_BY_ID.get(achievement_id)
             if not achievement:
                 self.logger.error("Achievement not found", extra={"achievement_id": achievement_id})
                 return None
             
+            # Check if already unlocked
+            bit = self.ACHIEVEMENT_BITS[achievement_id]
+            mask = self._achievement_mask(user)
+            if mask & bit:
+                return None
+            
             # Update user achievements
+            user["achievement_mask"] = mask | bit
             if "achievements" not in user:
                 user["achievements"] = []
             user["achievements"].append(achievement_id)
@@ -301,7 +378,7 @@ class PlayerProgression:
             user["level"] = self._calculate_level(new_xp)
             
             self.logger.info("Achievement unlocked", extra={
-                "user_id": user_id,
+                "user_id": user.get("id"),
                 "achievement_id": achievement_id,
                 "achievement_title": achievement.title,
                 "points_earned": achievement.points
@@ -312,12 +389,30 @@ class PlayerProgression:
         
         except Exception as e:
             self.logger.error("Error unlocking achievement", extra={
-                "user_id": user_id,
+                "user_id": user.get("id"),
                 "achievement_id": achievement_id,
                 "error": str(e)
             })
             return None
     
+    def _star_achievement_bits(self, total_stars: int, special_stars: int) -> int:
+        """Get the bitmask of star-collection achievements whose thresholds are met"""
+        bits = 0
+        for achievement_id, counter, threshold in self.STAR_ACHIEVEMENT_TIERS:
+            if (total_stars if counter == "total_stars" else special_stars) >= threshold:
+                bits |= self.ACHIEVEMENT_BITS[achievement_id]
+        return bits
+    
+    def _achievement_mask(self, user: dict) -> int:
+        """Get the user's unlocked-achievement bitmask, deriving it from the id list if needed"""
+        mask = user.get("achievement_mask")
+        if mask is None:
+            mask = 0
+            for achievement_id in user.get("achievements", []):
+                mask |= self.ACHIEVEMENT_BITS.get(achievement_id, 0)
+            user["achievement_mask"] = mask
+        return mask
+    
     async def track_star_collection(self, user_id: int, star_value: int = 1) -> List[dict]:
         """
         Track star collection for achievements and challenges
@@ -338,21 +433,14 @@ class PlayerProgression:
         user["total_stars"] = total_stars
         user["special_stars"] = special_stars
         
-        # Check for achievements
-        achievement_checks = [
-            ("first_star", total_stars >= 1),
-            ("collector_10", total_stars >= 10),
-            ("collector_50", total_stars >= 50),
-            ("collector_100", total_stars >= 100),
-            ("special_5", special_stars >= 5),
-            ("special_20", special_stars >= 20)
-        ]
-        
-        for achievement_id, condition in achievement_checks:
-            if condition:
-                achievement = await self.unlock_achievement(user_id, achievement_id)
-                if achievement:
-                    unlocked_achievements.append(achievement)
+        # Only unlock tiers that are met but not yet held
+        new_bits = self._star_achievement_bits(total_stars, special_stars) & ~self._achievement_mask(user)
+        while new_bits:
+            index = (new_bits & -new_bits).bit_length() - 1
+            new_bits &= new_bits - 1
+            achievement = self._unlock_achievement_on(user, self.ACHIEVEMENTS[index].id)
+            if achievement:
+                unlocked_achievements.append(achievement)
         
         # Update challenge progress
         for challenge in self.active_challenges:
@@ -404,9 +492,9 @@ class PlayerProgression:
             # Check for streak achievements
             achievement = None
             if new_streak >= 3:
-                achievement = await self.unlock_achievement(user_id, "streak_3")
+                achievement = self._unlock_achievement_on(user, "streak_3")
             if new_streak >= 7:
-                achievement = await self.unlock_achievement(user_id, "streak_7")
+                achievement = self._unlock_achievement_on(user, "streak_7")
             
             self.logger.info("Login streak updated", extra={
                 "user_id": user_id,
@@ -441,28 +529,28 @@ class PlayerProgression:
         else:
             progress_percentage = 100  # Max level
         
-        # Get challenge progress
+        # Get challenge progress, all as of the same moment
+        now = time.time()
         challenge_progress = []
         for challenge in self.active_challenges:
             progress = user.get(f"challenge_{challenge.id}", 0)
             is_complete = progress >= challenge.goal
             
             challenge_progress.append({
-                **challenge.to_dict(),
+                **challenge.to_dict(now),
                 "progress": progress,
                 "is_complete": is_complete,
                 "progress_percentage": min(100, int((progress / challenge.goal) * 100))
             })
         
         # Get unlocked achievements
+        # (skipping ids for achievements that might have been deleted)
         unlocked_achievements = [
-            next((a.to_dict() for a in self.ACHIEVEMENTS if a.id == achievement_id), None)
+            self.ACHIEVEMENTS_BY_ID[achievement_id].to_dict()
             for achievement_id in user.get("achievements", [])
+            if achievement_id in self.ACHIEVEMENTS_BY_ID
         ]
         
-        # Remove None values (for achievements that might have been deleted)
-        unlocked_achievements = [a for a in unlocked_achievements if a]
-        
         # Get achievement completion percentage
         achievement_percentage = int((len(unlocked_achievements) / len(self.ACHIEVEMENTS)) * 100)
         
@@ -26,7 +26,7 @@ class ApiTestCase(unittest.TestCase):
 
     def test_collect_star_increases_score(self):
         stars.clear()
-        stars.append({'id': 's1', 'x': 0, 'y': 0})
+        stars['s1'] = {'id': 's1', 'x': 0, 'y': 0}
         start_score = m.score
         collect_star('s1')
         self.assertEqual(m.score, start_score + 1)
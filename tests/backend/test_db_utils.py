@@ -1,11 +1,13 @@
 """
 Test cases for database utilities (init_db and backup_db)
 """
+import errno
 import os
 import json
 import tempfile
 import unittest
 import shutil
+import sqlite3
 from datetime import datetime
 from unittest.mock import patch, MagicMock, mock_open
 
@@ -69,18 +71,17 @@ class TestInitDB(unittest.TestCase):
     @patch('sqlite3.connect')
     def test_init_database(self, mock_connect, mock_logger):
         """Test database initialization"""
-        # Setup mock connection and cursor
+        # Setup mock connection
         mock_conn = MagicMock()
-        mock_cursor = MagicMock()
         mock_connect.return_value = mock_conn
-        mock_conn.cursor.return_value = mock_cursor
         
         # Run the function
         init_db.init_database()
         
         # Verify correct calls were made
         mock_connect.assert_called_once()
-        self.assertTrue(mock_cursor.execute.called)
+        mock_conn.executescript.assert_called_once_with(init_db.SCHEMA_SQL)
+        mock_conn.executemany.assert_called_once()
         mock_conn.commit.assert_called_once()
         mock_conn.close.assert_called_once()
         
@@ -184,6 +185,84 @@ class TestBackupDB(unittest.TestCase):
             with self.assertRaises(SystemExit):
                 backup_db.backup_database()
     
+    @patch('server.backup_db.logger')
+    @patch('server.backup_db.datetime')
+    def test_backup_database_twice_in_same_second(self, mock_datetime, mock_logger):
+        """Test a rerun with the same timestamp replaces the earlier backup"""
+        mock_datetime.now.return_value = datetime(2025, 5, 20, 14, 30, 0)
+        live_db = os.path.join(self.temp_dir, "live.db")
+        conn = sqlite3.connect(live_db)
+        conn.execute("CREATE TABLE scores (value INTEGER)")
+        conn.execute("INSERT INTO scores VALUES (1)")
+        conn.commit()
+        conn.close()
+        paths = {"db_path": live_db, "backup_dir": self.backup_dir}
+        
+        first = backup_db.backup_database(paths)
+        second = backup_db.backup_database(paths)
+        
+        self.assertIsNotNone(first)
+        self.assertEqual(first, second)
+        conn = sqlite3.connect(second)
+        self.assertEqual(conn.execute("SELECT value FROM scores").fetchall(), [(1,)])
+        conn.close()
+        
+        # Taking a backup leaves the live database's journal mode alone
+        conn = sqlite3.connect(live_db)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+        conn.close()
+    
+    def test_json_formatter_includes_extra(self):
+        """Test that extra fields are serialized into the JSON log line"""
+        record = backup_db.logger.makeRecord(
+            "db_backup", 20, __file__, 1, "Backup done", (), None,
+            func="backup_database", extra={"size_bytes": 42}
+        )
+        entry = json.loads(backup_db.JsonFormatter().format(record))
+        
+        self.assertEqual(entry["timestamp"], record.created)
+        self.assertEqual(entry["message"], "Backup done")
+        self.assertEqual(entry["component"], "DBBackup")
+        self.assertEqual(entry["size_bytes"], 42)
+        
+        # Extra fields cannot overwrite the base keys
+        record = backup_db.logger.makeRecord(
+            "db_backup", 20, __file__, 1, "Backup done", (), None,
+            extra={"timestamp": "20250520_120000"}
+        )
+        entry = json.loads(backup_db.JsonFormatter().format(record))
+        self.assertEqual(entry["timestamp"], record.created)
+    
+    def test_fast_copy(self):
+        """Test kernel-side file copy helper"""
+        dest_path = os.path.join(self.temp_dir, "copy.db")
+        backup_db._fast_copy(self.db_path, dest_path)
+        
+        with open(dest_path) as f:
+            self.assertEqual(f.read(), "dummy data")
+        
+        # Fall back to shutil when copy_file_range is unsupported
+        with patch('os.copy_file_range', create=True) as mock_copy:
+            mock_copy.side_effect = OSError(errno.EXDEV, "Cross-device link")
+            os.remove(dest_path)
+            backup_db._fast_copy(self.db_path, dest_path)
+        
+        with open(dest_path) as f:
+            self.assertEqual(f.read(), "dummy data")
+    
+    def test_stream_backup(self):
+        """Test streaming a backup file to a descriptor"""
+        dest_path = os.path.join(self.temp_dir, "streamed.db")
+        fd = os.open(dest_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        try:
+            sent = backup_db.stream_backup(fd, self.db_path)
+        finally:
+            os.close(fd)
+        
+        self.assertEqual(sent, len("dummy data"))
+        with open(dest_path) as f:
+            self.assertEqual(f.read(), "dummy data")
+    
     @patch('server.backup_db.logger')
     def test_cleanup_old_backups(self, mock_logger):
         """Test cleanup of old backups"""
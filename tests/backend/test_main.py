@@ -29,6 +29,7 @@ class TestMainAPI(unittest.TestCase):
         stars.clear()
         players.clear()
         m.score = 0
+        m._token_cache.clear()
         
         # Set test environment variables
         self.env_patcher = patch.dict('os.environ', {
@@ -48,9 +49,9 @@ class TestMainAPI(unittest.TestCase):
         # Generate a star
         star = m.generate_star()
         
-        # Verify it was added to the global stars list
+        # Verify it was added to the global stars dict under its id
         self.assertEqual(len(m.stars), 1)
-        self.assertEqual(m.stars[0], star)
+        self.assertEqual(m.stars[star['id']], star)
         
         # Verify the star has the required properties
         self.assertIn('id', star)
@@ -79,12 +80,12 @@ class TestMainAPI(unittest.TestCase):
         
         # Add a star with specific value
         star_id = 'special_star'
-        m.stars.append({
+        m.stars[star_id] = {
             'id': star_id,
             'x': 100,
             'y': 100,
             'value': 10
-        })
+        }
         
         # Collect the star
         result = asyncio.run(m.collect_star(star_id))
@@ -94,7 +95,20 @@ class TestMainAPI(unittest.TestCase):
         self.assertEqual(m.score, 10)  # Default value is 10
         self.assertEqual(len(m.stars), 0)
     
-    @patch('server.main.bcrypt')
+    @patch('server.main._user_id_by_name', 'lookup_stmt', create=True)
+    @patch('server.main.SessionLocal')
+    def test_get_or_create_user_id_releases_session(self, mock_session):
+        """Test looking up an existing user ends its session straight away"""
+        mock_db = mock_session.return_value
+        mock_db.execute.return_value.scalar.return_value = 7
+        
+        self.assertEqual(m.get_or_create_user_id('ace'), 7)
+        
+        mock_db.execute.assert_called_once_with('lookup_stmt', {'username': 'ace'})
+        mock_db.commit.assert_not_called()
+        mock_db.close.assert_called_once()
+    
+    @patch('server.main._password_hasher')
     def test_register_user_duplicate(self, mock_bcrypt):
         """Test registering a user that already exists"""
         # Setup mock
@@ -122,7 +136,7 @@ class TestMainAPI(unittest.TestCase):
             # Restore the original players dictionary
             m.players = original_players
     
-    @patch('server.main.bcrypt')
+    @patch('server.main._password_hasher')
     def test_register_user_validation(self, mock_bcrypt):
         """Test user registration validation"""
         mock_bcrypt.hash.return_value = "hashed_password"
@@ -144,6 +158,81 @@ class TestMainAPI(unittest.TestCase):
         result = m.register_user(data)
         self.assertEqual(result['status'], 'error')
     
+    def test_get_challenges_payload_is_shared(self):
+        """Test that clients get the progression tracker's shared challenges list"""
+        mock_progression = MagicMock()
+        with patch('server.main.get_progression', return_value=mock_progression):
+            self.assertIs(m.get_challenges_payload(), mock_progression.get_challenges.return_value)
+    
+    def test_user_stats_cache(self):
+        """Test cached star counts expire, evict and invalidate by user id"""
+        m._stats_cache.clear()
+        m._stats_cache_names.clear()
+        m.cache_user_stats('ace', 1, 7)
+        self.assertEqual(m._stats_cache['ace'][1:], (1, 7))
+        
+        m.invalidate_user_stats({1: 2})
+        self.assertNotIn('ace', m._stats_cache)
+        self.assertNotIn(1, m._stats_cache_names)
+        
+        with patch('server.main.STATS_CACHE_SIZE', 1):
+            m.cache_user_stats('ace', 1, 7)
+            m.cache_user_stats('bee', 2, 3)
+        self.assertEqual(list(m._stats_cache), ['bee'])
+        self.assertEqual(m._stats_cache_names, {2: 'bee'})
+        m._stats_cache.clear()
+        m._stats_cache_names.clear()
+    
+    def test_json_formatter(self):
+        """Test JSON log lines carry the record time and extra fields"""
+        record = m.logger.makeRecord(
+            m.logger.name, m.logging.INFO, __file__, 1, "Generated star", (),
+            None, extra={"star_id": "star_1"})
+        line = json.loads(m.JsonFormatter().format(record))
+        self.assertEqual(line['timestamp'], record.created)
+        self.assertEqual(line['message'], "Generated star")
+        self.assertEqual(line['star_id'], "star_1")
+    
+    def test_queue_handler_defers_formatting(self):
+        """Test queued records keep their args and exc_info for the listener"""
+        log_queue = m.queue.SimpleQueue()
+        handler = m.RawQueueHandler(log_queue)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = m.logger.makeRecord(
+                m.logger.name, m.logging.ERROR, __file__, 1, "Failed %s", ("bee",),
+                sys.exc_info())
+        handler.handle(record)
+        
+        queued = log_queue.get_nowait()
+        self.assertEqual(queued.msg, "Failed %s")
+        self.assertEqual(queued.args, ("bee",))
+        self.assertIsNotNone(queued.exc_info)
+        line = json.loads(m.JsonFormatter().format(queued))
+        self.assertEqual(line['message'], "Failed bee")
+        self.assertIn("ValueError: boom", line['exception'])
+    
+    def test_generate_star_evicts_oldest(self):
+        """Test that spawning past MAX_STARS drops the oldest star"""
+        with patch('server.main.MAX_STARS', 2):
+            first = m.generate_star()
+            second = m.generate_star()
+            third = m.generate_star()
+        self.assertEqual(list(stars), [second['id'], third['id']])
+        self.assertNotIn(first['id'], m._stars_added)
+    
+    @patch('server.main.jwt')
+    def test_create_token_includes_user_id(self, mock_jwt):
+        """Test tokens carry the user id claim when one is given"""
+        m.create_token('ace', 7)
+        payload = mock_jwt.encode.call_args.args[0]
+        self.assertEqual(payload['sub'], 'ace')
+        self.assertEqual(payload['uid'], 7)
+        
+        m.create_token('ace')
+        self.assertNotIn('uid', mock_jwt.encode.call_args.args[0])
+    
     @patch('server.main.jwt')
     def test_verify_token(self, mock_jwt):
         """Test JWT token verification"""
@@ -152,16 +241,31 @@ class TestMainAPI(unittest.TestCase):
         valid_payload = {'sub': 'user_id', 'username': 'testuser'}
         
         # Test successful verification
+        mock_jwt.get_unverified_claims.return_value = valid_payload
         mock_jwt.decode.return_value = valid_payload
         result = m.verify_token('valid_token')
         self.assertEqual(result, valid_payload)
         mock_jwt.decode.assert_called_once()
         
+        # Expired tokens are rejected without verifying the signature
+        mock_jwt.decode.reset_mock()
+        mock_jwt.get_unverified_claims.return_value = {'sub': 'user_id', 'exp': 0}
+        self.assertIsNone(m.verify_token('expired_token'))
+        mock_jwt.decode.assert_not_called()
+        mock_jwt.get_unverified_claims.return_value = valid_payload
+        
         # Test failed verification (decode raises exception)
         mock_jwt.decode.reset_mock()
         mock_jwt.decode.side_effect = m.JWTError("Invalid token")
         result = m.verify_token('invalid_token')
         self.assertIsNone(result)
+        
+        # Verified tokens are served from the cache without decoding again
+        mock_jwt.decode.reset_mock()
+        mock_jwt.decode.side_effect = None
+        self.assertEqual(m.verify_token('valid_token'), valid_payload)
+        mock_jwt.decode.assert_not_called()
+        self.assertNotIn('valid_token', m._token_cache)
     
     @patch('server.main.verify_token')
     @patch('server.main.SessionLocal')
@@ -236,41 +340,225 @@ class TestAsyncFunctions(unittest.IsolatedAsyncioTestCase):
                 
                 # Check that generate_star was called
                 self.assertEqual(mock_generate.call_count, 3)
+                
+                # Sleeps run to the next deadline, not a fixed interval after
+                # the work
+                delay = mock_sleep.call_args_list[0].args[0]
+                self.assertTrue(0 <= delay <= m.STAR_SPAWN_INTERVAL)
     
-    async def test_websocket_endpoint(self):
-        """Test WebSocket endpoint connections"""
-        # Create a mock WebSocket
-        mock_socket = AsyncMock()
-        mock_socket.accept = AsyncMock()
-        mock_socket.close = AsyncMock()
-        mock_socket.send_json = AsyncMock()
-        mock_socket.receive_json = AsyncMock()
+    async def test_broadcast_loop(self):
+        """Test the rate-capped state broadcast loop"""
+        with patch('asyncio.sleep', AsyncMock()) as mock_sleep, \
+             patch('server.main.STATE_HEARTBEAT_INTERVAL', 0):
+            with patch('server.main.sm', AsyncMock()) as mock_sm:
+                mock_sleep.side_effect = [None, Exception("Stop loop")]
+                
+                try:
+                    await m.broadcast_loop()
+                except Exception:
+                    pass
+                
+                # One emit per tick, regardless of connection count
+                self.assertEqual(mock_sm.emit.call_count, 2)
+                delay = mock_sleep.call_args.args[0]
+                self.assertTrue(0 <= delay <= m.STATE_BROADCAST_INTERVAL)
+    
+    async def test_broadcast_loop_wakes_on_change(self):
+        """Test that a state change wakes the broadcaster before the heartbeat"""
+        with patch('server.main.sm', AsyncMock()) as mock_sm, \
+             patch('server.main.STATE_HEARTBEAT_INTERVAL', 60):
+            task = asyncio.create_task(m.broadcast_loop())
+            try:
+                await asyncio.sleep(0.1)
+                self.assertEqual(mock_sm.emit.call_count, 0)
+                
+                m.mark_state_changed()
+                await asyncio.sleep(0.1)
+                self.assertEqual(mock_sm.emit.call_count, 1)
+            finally:
+                task.cancel()
+    
+    @patch('server.main._credit_stars', 'credit_stmt', create=True)
+    @patch('server.main.SessionLocal')
+    async def test_flush_star_credits(self, mock_session):
+        """Test pending star credits are written in one batch"""
+        mock_db = mock_session.return_value
+        m._pending_stars.clear()
+        m._pending_stars[1] += 2
+        m._pending_stars[2] += 1
+        
+        await m.flush_star_credits()
+        
+        mock_db.execute.assert_called_once_with('credit_stmt', [
+            {'user_id': 1, 'delta': 2},
+            {'user_id': 2, 'delta': 1},
+        ])
+        mock_db.commit.assert_called_once()
+        mock_db.close.assert_called_once()
+        self.assertFalse(m._pending_stars)
         
-        # Mock out the socket manager
+        # A failed write keeps the credits for the next flush
+        mock_db.execute.side_effect = Exception("database is locked")
+        m._pending_stars[1] += 3
+        await m.flush_star_credits()
+        mock_db.rollback.assert_called_once()
+        self.assertEqual(m._pending_stars[1], 3)
+        m._pending_stars.clear()
+    
+    @patch('server.main.bcrypt')
+    async def test_check_password_caches_result(self, mock_bcrypt):
+        """Test repeat logins reuse a successful bcrypt check until the hash changes"""
+        m._login_cache.clear()
+        mock_bcrypt.verify.return_value = True
+        
+        self.assertTrue(await m.check_password('secret', 'hash1'))
+        self.assertTrue(await m.check_password('secret', 'hash1'))
+        mock_bcrypt.verify.assert_called_once_with('secret', 'hash1')
+        
+        # A new stored hash (password change) is verified again
+        mock_bcrypt.verify.return_value = False
+        self.assertFalse(await m.check_password('secret', 'hash2'))
+        self.assertEqual(mock_bcrypt.verify.call_count, 2)
+        
+        # Failures are never cached, so each wrong guess runs bcrypt
+        self.assertFalse(await m.check_password('secret', 'hash2'))
+        self.assertEqual(mock_bcrypt.verify.call_count, 3)
+        self.assertEqual(len(m._login_cache), 1)
+        
+        # Attempts are stored only as a keyed digest
+        (stored_hash, digest), = m._login_cache
+        self.assertEqual(stored_hash, 'hash1')
+        self.assertNotEqual(digest, m.hashlib.sha256(b'secret').digest())
+        m._login_cache.clear()
+    
+    async def test_broadcast_state_reuses_snapshot(self):
+        """Test that unchanged ticks reuse the cached state delta"""
         with patch('server.main.sm', AsyncMock()) as mock_sm:
-            # Set up receive_json to first return a connection message then raise disconnect
-            mock_socket.receive_json.side_effect = [
-                {"type": "connect", "data": {"username": "test_user"}},
-                m.WebSocketDisconnect()
-            ]
+            await m.broadcast_state()
+            await m.broadcast_state()
+            first = mock_sm.emit.call_args_list[0].args[1]
+            second = mock_sm.emit.call_args_list[1].args[1]
+            self.assertIs(first, second)
             
-            # Mock generate_star to avoid randomness
-            with patch('server.main.generate_star') as mock_generate:
-                mock_generate.return_value = {"id": "test_star", "x": 0.5, "y": 0.5}
-                
-                # Mock spawn_stars to avoid async loop
-                with patch('server.main.spawn_stars', AsyncMock()):
-                    # Run the endpoint handler with exception handling
-                    try:
-                        await m.websocket_endpoint(mock_socket)
-                    except Exception:
-                        pass
-                    
-                    # Verify connection was accepted
-                    mock_socket.accept.assert_called_once()
-                    
-                    # Verify socket was added to players
-                    self.assertIn(mock_socket, m.players)
+            # A mutation invalidates the delta
+            m.generate_star()
+            await m.broadcast_state()
+            third = mock_sm.emit.call_args_list[2].args[1]
+            self.assertIsNot(third, first)
+    
+    async def test_broadcast_state_sends_star_delta(self):
+        """Test that broadcasts carry only the stars added and removed"""
+        with patch('server.main.sm', AsyncMock()) as mock_sm:
+            await m.broadcast_state()
+            
+            kept = m.generate_star()
+            gone = m.generate_star()
+            await m.broadcast_state()
+            delta = mock_sm.emit.call_args.args[1]
+            self.assertEqual(mock_sm.emit.call_args.args[0], 'delta')
+            self.assertEqual(delta['stars_add'], [kept, gone])
+            self.assertEqual(delta['stars_rm'], [])
+            
+            with patch('server.main.generate_star'):
+                m.collect_star(gone['id'])
+            await m.broadcast_state()
+            delta = mock_sm.emit.call_args.args[1]
+            self.assertEqual(delta['stars_add'], [])
+            self.assertEqual(delta['stars_rm'], [gone['id']])
+            
+            # The full snapshot still lists every live star
+            self.assertEqual(m.get_state_snapshot()['stars'], list(m.stars.values()))
+    
+    async def test_broadcast_state_removes_star_seen_in_join_snapshot(self):
+        """Test a star spawned and collected between deltas is still removed"""
+        with patch('server.main.sm', AsyncMock()) as mock_sm:
+            await m.broadcast_state()
+            
+            star = m.generate_star()
+            # A client joining now receives the star in its snapshot
+            self.assertIn(star, m.get_state_snapshot()['stars'])
+            with patch('server.main.generate_star'):
+                m.collect_star(star['id'])
+            await m.broadcast_state()
+            
+            delta = mock_sm.emit.call_args.args[1]
+            self.assertEqual(delta['stars_add'], [])
+            self.assertEqual(delta['stars_rm'], [star['id']])
+    
+    async def test_broadcast_state_player_columns(self):
+        """Test that players are sent as parallel columns"""
+        m.players.clear()
+        m.players['sock'] = {'username': 'ace', 'user_id': 1, 'x': 0.5, 'y': -0.2}
+        m.mark_state_changed()
+        try:
+            state = m.get_state_snapshot()
+            self.assertEqual(state['players'],
+                             {'names': ['ace'], 'xs': [0.5], 'ys': [-0.2]})
+        finally:
+            m.players.clear()
+            m.mark_state_changed()
+    
+    async def test_websocket_endpoint(self):
+        """Test WebSocket endpoint decodes and handles client messages"""
+        mock_socket = AsyncMock()
+        join = {"type": "join", "username": "test_user"}
+        # Frames are decoded with orjson when it is installed, else receive_json
+        mock_socket.receive_text.side_effect = [json.dumps(join), m.WebSocketDisconnect()]
+        mock_socket.receive_json.side_effect = [join, m.WebSocketDisconnect()]
+        
+        mock_progression = MagicMock()
+        mock_progression.update_login_streak = AsyncMock(return_value=(1, None))
+        mock_progression.get_user_progress = AsyncMock(return_value={'level': 0})
+        
+        with patch('server.main.sm', AsyncMock()), \
+             patch('server.main.verify_token', return_value={'sub': 'test_user', 'uid': 5}), \
+             patch('server.main.get_progression', return_value=mock_progression), \
+             patch('server.main.SessionLocal') as mock_session, \
+             patch('server.main.get_challenges_payload', return_value=[]), \
+             patch('server.main.get_state_snapshot', return_value={'stars': []}), \
+             patch('server.main.flush_outbound', AsyncMock()) as mock_flush:
+            await m.websocket_endpoint(mock_socket)
+        
+        mock_socket.accept.assert_called_once()
+        if m.orjson is not None:
+            mock_socket.receive_text.assert_called()
+            mock_socket.receive_json.assert_not_called()
+        
+        # The join was handled with the user id carried by the token
+        mock_progression.update_login_streak.assert_awaited_once_with(5)
+        mock_session.assert_not_called()
+        self.assertEqual(
+            [event for event, _ in mock_flush.call_args.args[0]],
+            ['progress', 'challenges', 'state'])
+        
+        # The player is dropped again once the socket ends
+        self.assertNotIn(mock_socket, m.players)
+    
+    async def test_websocket_endpoint_setup_failure_drops_player(self):
+        """Test a failure before the receive loop still removes the player"""
+        mock_socket = AsyncMock()
+        
+        with patch('server.main.sm', AsyncMock()), \
+             patch('server.main.verify_token', return_value={'sub': 'ace'}), \
+             patch('server.main.get_progression', side_effect=RuntimeError("no db")):
+            with self.assertRaises(RuntimeError):
+                await m.websocket_endpoint(mock_socket)
+        
+        mock_socket.accept.assert_called_once()
+        self.assertNotIn(mock_socket, m.players)
+    
+    async def test_websocket_endpoint_rejects_malformed_token(self):
+        """Test malformed tokens are closed without verifying them"""
+        mock_socket = AsyncMock()
+        mock_socket.query_params = {'token': 'not-a-jwt'}
+        
+        with patch('server.main.jwt', MagicMock()), \
+             patch('server.main.verify_token') as mock_verify:
+            await m.websocket_endpoint(mock_socket)
+        
+        mock_verify.assert_not_called()
+        mock_socket.close.assert_called_once_with(code=403)
+        mock_socket.accept.assert_not_called()
 
 
 if __name__ == '__main__':
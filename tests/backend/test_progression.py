@@ -53,6 +53,25 @@ class TestPlayerProgression(unittest.TestCase):
         """Clean up after tests"""
         self.loop.close()
     
+    def test_logger_configured_once(self):
+        """Test that creating instances does not add logging handlers"""
+        shared_logger = logging.getLogger("progression")
+        handler_count = len(shared_logger.handlers)
+        
+        PlayerProgression(self.db_session)
+        PlayerProgression(self.db_session)
+        
+        self.assertEqual(len(shared_logger.handlers), handler_count)
+        
+        # Lines are real JSON, quotes and extra fields included
+        record = shared_logger.makeRecord(
+            "progression", logging.INFO, __file__, 1, 'Unlocked "First Star"', (), None,
+            extra={"user_id": 7})
+        line = json.loads(shared_logger.handlers[0].formatter.format(record))
+        self.assertEqual(line["message"], 'Unlocked "First Star"')
+        self.assertEqual(line["component"], "Progression")
+        self.assertEqual(line["user_id"], 7)
+    
     def test_achievement_creation(self):
         """Test that achievements can be created correctly"""
         achievement = Achievement("test_id", "Test Achievement", "Test description", "🔆", 10)
@@ -87,6 +106,7 @@ class TestPlayerProgression(unittest.TestCase):
             (100, 1),     # 100 XP = level 1
             (200, 1),     # 200 XP < 250 XP (level 2 threshold) = level 1
             (250, 2),     # 250 XP = level 2
+            (1000, 6),    # 1000 XP meets both level 5 and 6 thresholds = level 6
             (3000, 9),    # 3000 XP < 3250 XP (level 10 threshold) = level 9
             (3250, 10),   # 3250 XP = level 10
             (5000, 10)    # 5000 XP > max defined level = level 10
@@ -97,6 +117,15 @@ class TestPlayerProgression(unittest.TestCase):
                 level = self.progression._calculate_level(xp)
                 self.assertEqual(level, expected_level, f"XP {xp} should be level {expected_level}, got {level}")
     
+    def test_level_table_matches_thresholds(self):
+        """Test that the precomputed XP table agrees with the thresholds"""
+        thresholds = PlayerProgression.LEVEL_THRESHOLDS
+        self.assertEqual(len(PlayerProgression.LEVEL_BY_XP), thresholds[-1])
+        
+        for xp in range(-10, thresholds[-1] + 10):
+            expected_level = max(0, sum(1 for t in thresholds if xp >= t) - 1)
+            self.assertEqual(self.progression._calculate_level(xp), expected_level)
+    
     def test_get_next_level_xp(self):
         """Test getting XP required for the next level"""
         test_cases = [
@@ -112,7 +141,7 @@ class TestPlayerProgression(unittest.TestCase):
     
     @patch('progression.PlayerProgression._get_user')
     @patch('progression.PlayerProgression._update_user_progression')
-    @patch('progression.PlayerProgression.unlock_achievement')
+    @patch('progression.PlayerProgression._unlock_achievement_on')
     async def test_add_experience(self, mock_unlock, mock_update, mock_get_user):
         """Test adding experience and leveling up"""
         # Mock user data
@@ -138,7 +167,8 @@ class TestPlayerProgression(unittest.TestCase):
         mock_unlock.reset_mock()
         
         # Test level 5 achievement
-        mock_get_user.return_value = {"id": 1, "experience": 950, "level": 4}
+        user = {"id": 1, "experience": 950, "level": 4}
+        mock_get_user.return_value = user
         
         # Add 100 XP, which should level up to level 5
         result = await self.progression.add_experience(1, 100)
@@ -148,7 +178,7 @@ class TestPlayerProgression(unittest.TestCase):
         self.assertEqual(result[1], 5)     # New level
         
         # Check that level 5 achievement was unlocked
-        mock_unlock.assert_called_once_with(1, "level_5")
+        mock_unlock.assert_called_once_with(user, "level_5")
     
     @patch('progression.PlayerProgression._get_user')
     async def test_track_star_collection(self, mock_get_user):
@@ -162,9 +192,9 @@ class TestPlayerProgression(unittest.TestCase):
             "special_stars": 0
         }
         
-        # Mock the unlock_achievement method
-        self.progression.unlock_achievement = AsyncMock()
-        self.progression.unlock_achievement.return_value = {
+        # Mock the achievement unlock helper
+        self.progression._unlock_achievement_on = MagicMock()
+        self.progression._unlock_achievement_on.return_value = {
             "id": "first_star",
             "title": "First Star",
             "description": "Collect your first star",
@@ -176,12 +206,12 @@ class TestPlayerProgression(unittest.TestCase):
         result = await self.progression.track_star_collection(1, 1)
         
         # Verify first_star achievement was unlocked
-        self.progression.unlock_achievement.assert_called_once_with(1, "first_star")
+        self.progression._unlock_achievement_on.assert_called_once_with(mock_get_user.return_value, "first_star")
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0]["id"], "first_star")
         
         # Reset mock
-        self.progression.unlock_achievement.reset_mock()
+        self.progression._unlock_achievement_on.reset_mock()
         
         # Change user data to test special star
         mock_get_user.return_value = {
@@ -194,7 +224,7 @@ class TestPlayerProgression(unittest.TestCase):
         }
         
         # Mock achievement return value
-        self.progression.unlock_achievement.return_value = {
+        self.progression._unlock_achievement_on.return_value = {
             "id": "special_5",
             "title": "Special Star Hunter",
             "description": "Collect 5 special stars",
@@ -206,7 +236,7 @@ class TestPlayerProgression(unittest.TestCase):
         result = await self.progression.track_star_collection(1, 5)
         
         # Verify special_5 achievement was unlocked
-        self.progression.unlock_achievement.assert_called_once_with(1, "special_5")
+        self.progression._unlock_achievement_on.assert_called_once_with(mock_get_user.return_value, "special_5")
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0]["id"], "special_5")
     
@@ -64,6 +64,9 @@ class TestPlayerProgressionExtended(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result["icon"], "🏆")
         self.assertEqual(result["points"], 50)
         self.assertEqual(result["hidden"], True)
+        
+        # Serialized once and reused
+        self.assertIs(achievement.to_dict(), result)
     
     def test_challenge_to_dict(self):
         """Test Challenge serialization"""
@@ -98,14 +101,14 @@ class TestPlayerProgressionExtended(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result["end_time"], expected_end.isoformat())
         
         # Check remaining hours calculation
-        with patch('server.progression.datetime') as mock_datetime:
+        with patch('server.progression.time') as mock_time:
             # Test with 12 hours elapsed
-            mock_datetime.now.return_value = start_time + timedelta(hours=12)
+            mock_time.time.return_value = (start_time + timedelta(hours=12)).timestamp()
             result = challenge.to_dict()
             self.assertAlmostEqual(result["remaining_hours"], 12, delta=0.1)
             
             # Test with expired challenge
-            mock_datetime.now.return_value = start_time + timedelta(hours=25)
+            mock_time.time.return_value = (start_time + timedelta(hours=25)).timestamp()
             result = challenge.to_dict()
             self.assertEqual(result["remaining_hours"], 0)
     
@@ -122,14 +125,18 @@ class TestPlayerProgressionExtended(unittest.IsolatedAsyncioTestCase):
         )
         
         # Test not expired
-        with patch('server.progression.datetime') as mock_datetime:
-            mock_datetime.now.return_value = challenge.start_time + timedelta(hours=12)
+        with patch('server.progression.time') as mock_time:
+            mock_time.time.return_value = (challenge.start_time + timedelta(hours=12)).timestamp()
             self.assertFalse(challenge.is_expired())
         
         # Test expired
-        with patch('server.progression.datetime') as mock_datetime:
-            mock_datetime.now.return_value = challenge.start_time + timedelta(hours=25)
+        with patch('server.progression.time') as mock_time:
+            mock_time.time.return_value = (challenge.start_time + timedelta(hours=25)).timestamp()
             self.assertTrue(challenge.is_expired())
+        
+        # An explicit timestamp is used as-is
+        self.assertFalse(challenge.is_expired((challenge.start_time + timedelta(hours=12)).timestamp()))
+        self.assertTrue(challenge.is_expired((challenge.start_time + timedelta(hours=25)).timestamp()))
     
     def test_refresh_challenges(self):
         """Test refreshing expired challenges"""
@@ -218,6 +225,33 @@ class TestPlayerProgressionExtended(unittest.IsolatedAsyncioTestCase):
             self.assertEqual(len(result), 2)
             self.assertEqual(result[0]["id"], "challenge1")
             self.assertEqual(result[1]["id"], "challenge2")
+            
+            # The serialized list is reused until the challenge set changes
+            self.assertIs(self.progression.get_challenges(), result)
+            challenge1.to_dict.assert_called_once()
+            
+            self.progression.active_challenges = [challenge2]
+            result = self.progression.get_challenges()
+            self.assertEqual([c["id"] for c in result], ["challenge2"])
+            
+            # ...or the list is old enough for remaining_hours to drift
+            self.progression._challenges_built_at -= self.progression.CHALLENGES_MAX_AGE_SECONDS
+            self.assertIsNot(self.progression.get_challenges(), result)
+    
+    def test_get_challenges_after_rollover(self):
+        """Test an expired challenge set is replaced without waiting for the cache"""
+        first = self.progression.get_challenges()
+        for challenge in self.progression.active_challenges:
+            challenge._end_ts = 0.0
+        
+        result = self.progression.get_challenges()
+        
+        self.assertIsNot(result, first)
+        self.assertEqual(
+            [c["id"] for c in result],
+            [c.id for c in self.progression.active_challenges]
+        )
+        self.assertTrue(all(c["remaining_hours"] > 0 for c in result))
     
     def test_get_achievements(self):
         """Test retrieving available achievements"""
@@ -235,6 +269,9 @@ class TestPlayerProgressionExtended(unittest.IsolatedAsyncioTestCase):
             self.assertIn("icon", achievement)
             self.assertIn("points", achievement)
             self.assertIn("hidden", achievement)
+        
+        # Static list, built once
+        self.assertIs(self.progression.get_achievements(), achievements)
     
     @patch('server.progression.datetime')
     async def test_update_login_streak(self, mock_datetime):
@@ -253,18 +290,16 @@ class TestPlayerProgressionExtended(unittest.IsolatedAsyncioTestCase):
         
         self.progression._get_user = AsyncMock(return_value=mock_user)
         self.progression._update_user_progression = AsyncMock()
-        self.progression.unlock_achievement = AsyncMock(return_value={"id": "streak_3"})
         
         streak, achievement = await self.progression.update_login_streak(user_id=1)
 
-        # Consecutive day should increase streak
+        # Consecutive day should increase streak and unlock streak_3
         self.assertEqual(streak, 3)
-        # Note: achievement may be None depending on implementation details
+        self.assertEqual(achievement["id"], "streak_3")
+        self.assertIn("streak_3", mock_user["achievements"])
         
         # Test streak with a long gap (more than 1 day)
         mock_user["last_login"] = (current_time - timedelta(days=5)).isoformat()
-        self.progression.unlock_achievement.reset_mock()
-        self.progression.unlock_achievement.return_value = None
         
         streak, achievement = await self.progression.update_login_streak(user_id=1)
         
@@ -295,11 +330,11 @@ class TestPlayerProgressionExtended(unittest.IsolatedAsyncioTestCase):
         
         # Set up mocks
         self.progression._get_user = AsyncMock(return_value=mock_user)
-        # Configure unlock_achievement to return a achievement dict for the first call 
-        # and None for subsequent calls in the achievement_checks list
+        # Configure the unlock helper to return an achievement dict for every
+        # call in the achievement_checks list
         achievement_dict = {"id": "collector_10", "title": "Star Collector"}
-        self.progression.unlock_achievement = AsyncMock()
-        self.progression.unlock_achievement.return_value = achievement_dict
+        self.progression._unlock_achievement_on = MagicMock()
+        self.progression._unlock_achievement_on.return_value = achievement_dict
         
         # Regular star collection (total becomes 10)
         results = await self.progression.track_star_collection(user_id=1, star_value=1)
@@ -307,17 +342,18 @@ class TestPlayerProgressionExtended(unittest.IsolatedAsyncioTestCase):
         # Verify star counts updated
         self.assertEqual(mock_user["total_stars"], 10)
         
-        # Ensure at least one unlock_achievement call was made
-        self.progression.unlock_achievement.assert_called()
+        # The user is fetched once and handed to every achievement check
+        self.progression._get_user.assert_awaited_once_with(1)
+        self.progression._unlock_achievement_on.assert_any_call(mock_user, "collector_10")
         
         # The results will contain any unlocked achievements
         # Don't assert the exact number as implementation might differ
         
         # Special star collection
         # Reset our mocks
-        self.progression.unlock_achievement.reset_mock()
+        self.progression._unlock_achievement_on.reset_mock()
         special_achievement = {"id": "special_5", "title": "Special Star Hunter"}
-        self.progression.unlock_achievement.return_value = special_achievement
+        self.progression._unlock_achievement_on.return_value = special_achievement
         
         # Test with a special star (value > 1)
         results = await self.progression.track_star_collection(user_id=1, star_value=2)
@@ -327,10 +363,68 @@ class TestPlayerProgressionExtended(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(mock_user["special_stars"], 5)
         
         # Verify some achievement was checked
-        self.progression.unlock_achievement.assert_called()
+        self.progression._unlock_achievement_on.assert_any_call(mock_user, "special_5")
         
         # Don't assert the exact results as implementation details may vary
     
+    async def test_track_star_collection_unlocks_new_tiers_only(self):
+        """Test that tiers already held are not checked again"""
+        self.progression.players_cache[1] = {
+            "id": 1,
+            "experience": 0,
+            "level": 0,
+            "total_stars": 49,
+            "special_stars": 0,
+            "achievements": ["first_star", "collector_10"]
+        }
+        
+        results = await self.progression.track_star_collection(1)
+        self.assertEqual([a["id"] for a in results], ["collector_50"])
+        
+        with patch.object(self.progression, '_unlock_achievement_on') as mock_unlock:
+            self.assertEqual(await self.progression.track_star_collection(1), [])
+            mock_unlock.assert_not_called()
+    
+    async def test_unlock_achievement(self):
+        """Test unlocking an achievement awards its points only once"""
+        result = await self.progression.unlock_achievement(1, "first_star")
+        
+        self.assertEqual(result["id"], "first_star")
+        user = self.progression.players_cache[1]
+        self.assertEqual(user["achievements"], ["first_star"])
+        self.assertEqual(user["experience"], 5)
+        
+        self.assertIsNone(await self.progression.unlock_achievement(1, "first_star"))
+        self.assertIsNone(await self.progression.unlock_achievement(1, "no_such_achievement"))
+        self.assertEqual(user["experience"], 5)
+        self.assertEqual(user["achievement_mask"], self.progression.ACHIEVEMENT_BITS["first_star"])
+        
+        # A record with only the id list gets its mask derived on first check
+        self.progression.players_cache[2] = {"id": 2, "experience": 0, "achievements": ["streak_3"]}
+        self.assertIsNone(await self.progression.unlock_achievement(2, "streak_3"))
+        self.assertIsNotNone(await self.progression.unlock_achievement(2, "streak_7"))
+        self.assertEqual(
+            self.progression.players_cache[2]["achievement_mask"],
+            self.progression.ACHIEVEMENT_BITS["streak_3"] | self.progression.ACHIEVEMENT_BITS["streak_7"]
+        )
+    
+    async def test_get_user_progress_achievements(self):
+        """Test unlocked achievements are resolved by id and unknown ids skipped"""
+        self.progression.players_cache[1] = {
+            "id": 1,
+            "experience": 0,
+            "level": 0,
+            "achievements": ["first_star", "retired_achievement", "streak_3"]
+        }
+        
+        progress = await self.progression.get_user_progress(1)
+        
+        self.assertEqual(
+            [a["id"] for a in progress["unlocked_achievements"]],
+            ["first_star", "streak_3"]
+        )
+        self.assertEqual(progress["achievement_percentage"], 20)
+    
     def test_calculate_level(self):
         """Test level calculation based on XP"""
         test_cases = [